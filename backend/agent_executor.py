@@ -0,0 +1,100 @@
+# agent_executor.py - Bounded thread pool for running blocking agent calls off the event loop
+
+import os
+import asyncio
+import threading
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from backend.cancellation import CancelToken, current_cancel, count_cancellation
+
+# LLM calls spend nearly all of their time waiting on the network, so the pool
+# can be much larger than the CPU count. Tune with AGENT_MAX_WORKERS.
+AGENT_MAX_WORKERS = int(os.getenv("AGENT_MAX_WORKERS", "256"))
+
+_executor = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=AGENT_MAX_WORKERS, thread_name_prefix="agent")
+    return _executor
+
+
+async def run_agent(func, *args, **kwargs):
+    """
+    Runs a blocking agent function (LLM call, retries with time.sleep, PDF work)
+    in the shared pool and awaits its result without blocking the event loop.
+    Context variables are copied into the worker thread. If the awaiting
+    task is cancelled (e.g. the client disconnected), the worker's cancel
+    token is set so its LLM calls and fan-outs stop at the next check.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    token = CancelToken()
+    ctx.run(current_cancel.set, token)
+    call = functools.partial(ctx.run, func, *args, **kwargs)
+    try:
+        return await loop.run_in_executor(get_executor(), call)
+    except asyncio.CancelledError:
+        token.cancel()
+        count_cancellation("worker_calls")
+        raise
+
+
+def shutdown_executor(wait: bool = False):
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait, cancel_futures=True)
+        _executor = None
+
+
+_DONE = object()
+
+
+async def stream_agent(gen_func, *args, **kwargs):
+    """
+    Async iterator over a blocking generator (e.g. a streaming LLM call) that
+    runs in the shared pool. Items are handed to the event loop as they are
+    produced; if the consumer stops early the generator is closed.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stopped = threading.Event()
+    finished = False
+    ctx = contextvars.copy_context()
+    token = CancelToken()
+    ctx.run(current_cancel.set, token)
+
+    def produce():
+        gen = gen_func(*args, **kwargs)
+        try:
+            for item in gen:
+                if stopped.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (_DONE, e))
+            return
+        finally:
+            gen.close()
+        loop.call_soon_threadsafe(queue.put_nowait, (_DONE, None))
+
+    loop.run_in_executor(get_executor(), functools.partial(ctx.run, produce))
+    try:
+        while True:
+            item, error = await queue.get()
+            if error is not None:
+                finished = True
+                raise error
+            if item is _DONE:
+                finished = True
+                break
+            yield item
+    finally:
+        # The worker notices on its next item; don't hold the request open for it
+        stopped.set()
+        if not finished:
+            token.cancel()
+            count_cancellation("streams")
@@ -0,0 +1,119 @@
+# analysis_cache.py - Bounded in-memory LRU/TTL tier in front of the MarketAnalysis table
+
+import os
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "1024"))
+
+# How long an analysis stays fresh, in hours, per analysis_type. Market size
+# figures go stale fastest; segment breakdowns change slowly. Override with
+# ANALYSIS_CACHE_TTLS='{"global": 24, "regional": 168}'.
+DEFAULT_TTL_HOURS = 24 * 30
+ANALYSIS_TTL_HOURS = {
+    "global": 24 * 7,
+    "related": 24 * 14,
+    "vertical": 24 * 30,
+    "horizontal": 24 * 30,
+    "applications": 24 * 30,
+    "technology_segments": 24 * 30,
+    "regional": 24 * 14,
+    "end_user": 24 * 30,
+    "product_categories": 24 * 30,
+}
+ANALYSIS_TTL_HOURS.update(json.loads(os.getenv("ANALYSIS_CACHE_TTLS", "{}")))
+
+
+def ttl_for(analysis_type: str) -> timedelta:
+    return timedelta(hours=ANALYSIS_TTL_HOURS.get(analysis_type, DEFAULT_TTL_HOURS))
+
+
+def fresh_since(analysis_type: str) -> datetime:
+    """Oldest created_at that still counts as fresh for this analysis type."""
+    return datetime.utcnow() - ttl_for(analysis_type)
+
+
+class AnalysisCache:
+    """
+    LRU cache of analysis text keyed by (market, analysis_type). Entries expire
+    by the age of the underlying row, so rows loaded from the DB keep their TTL.
+    Each get() counts as a memory hit or a miss; a caller that then finds the
+    row in the DB reports it with record_db_hit(), so misses are the lookups
+    neither tier could serve.
+    """
+
+    def __init__(self, maxsize: int = ANALYSIS_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, market: str, analysis_type: str):
+        key = (market, analysis_type)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            data, created_at = entry
+            if created_at < fresh_since(analysis_type):
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def peek(self, market: str, analysis_type: str):
+        """Like get() but leaves the stats and LRU order alone, for re-checks of a counted lookup."""
+        with self._lock:
+            entry = self._entries.get((market, analysis_type))
+            if entry is None or entry[1] < fresh_since(analysis_type):
+                return None
+            return entry[0]
+
+    def record_db_hit(self):
+        """The last missed get() was served from the DB."""
+        with self._lock:
+            if self.misses:
+                self.misses -= 1
+            self.db_hits += 1
+
+    def set(self, market: str, analysis_type: str, data: str, created_at: datetime = None):
+        key = (market, analysis_type)
+        with self._lock:
+            self._entries[key] = (data, created_at or datetime.utcnow())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, market: str, analysis_type: str = None):
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] == market and (analysis_type is None or key[1] == analysis_type):
+                    del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.db_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.maxsize,
+                "lookups": lookups,
+                "hits": self.hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "db_hit_rate": round(self.db_hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "ttl_hours": dict(ANALYSIS_TTL_HOURS),
+            }
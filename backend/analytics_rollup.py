@@ -0,0 +1,53 @@
+# analytics_rollup.py - Hourly and daily counters of analytics events by type and market
+
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from backend.market_keys import canonical_market
+
+HOUR, DAY = "hour", "day"
+
+# Raw events older than this are deleted; the rollups keep their counts
+ANALYTICS_RAW_RETENTION_DAYS = float(os.getenv("ANALYTICS_RAW_RETENTION_DAYS", "30"))
+# Hourly rollups older than this are deleted; daily rollups are kept
+ANALYTICS_HOURLY_RETENTION_DAYS = float(os.getenv("ANALYTICS_HOURLY_RETENTION_DAYS", "90"))
+ANALYTICS_COMPACT_EVERY_SECONDS = float(os.getenv("ANALYTICS_COMPACT_EVERY_SECONDS", "3600"))
+
+
+def bucket_start(ts: datetime, granularity: str) -> datetime:
+    if granularity == DAY:
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def event_market(data) -> str:
+    """Canonical market an event refers to, or "" for events without one."""
+    market = data.get("market") if isinstance(data, dict) else None
+    return canonical_market(market) if market else ""
+
+
+def rollup_counts(events) -> Counter:
+    """
+    Counts events (dicts with event_type, data and timestamp) per
+    (granularity, bucket, event_type, market), for both granularities.
+    """
+    counts = Counter()
+    for event in events:
+        market = event_market(event["data"])
+        for granularity in (HOUR, DAY):
+            counts[(granularity, bucket_start(event["timestamp"], granularity), event["event_type"], market)] += 1
+    return counts
+
+
+def window_buckets(now: datetime, days: float) -> tuple:
+    """
+    Splits the window [now - days, now] into rollup ranges: hourly buckets
+    from the window's start up to the first midnight, daily buckets from
+    there on. Returns (first_hour, first_day). Reading whole days from the
+    daily table keeps a query to a few rows per day whatever the traffic.
+    """
+    first_hour = bucket_start(now - timedelta(days=days), HOUR)
+    first_day = bucket_start(first_hour, DAY)
+    if first_day < first_hour:
+        first_day += timedelta(days=1)
+    return first_hour, first_day
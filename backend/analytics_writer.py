@@ -0,0 +1,120 @@
+# analytics_writer.py - Buffers analytics events in memory and writes them in bulk off the request path
+
+import os
+import time
+import queue
+import threading
+from datetime import datetime
+
+ANALYTICS_QUEUE_SIZE = int(os.getenv("ANALYTICS_QUEUE_SIZE", "10000"))
+# A batch is written once it holds this many events or its oldest event is this old
+ANALYTICS_BATCH_SIZE = int(os.getenv("ANALYTICS_BATCH_SIZE", "500"))
+ANALYTICS_FLUSH_SECONDS = float(os.getenv("ANALYTICS_FLUSH_SECONDS", "2"))
+
+
+class AnalyticsWriter:
+    """
+    Bounded in-memory queue of analytics events drained by one background
+    thread, which hands them to write(events) in batches. log() never blocks:
+    when the queue is full the event is dropped and counted. close() writes
+    out whatever is still queued.
+    """
+
+    def __init__(self, write=None, capacity: int = ANALYTICS_QUEUE_SIZE,
+                 batch_size: int = ANALYTICS_BATCH_SIZE, flush_seconds: float = ANALYTICS_FLUSH_SECONDS):
+        self.write = write
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue(maxsize=capacity)
+        self._stopping = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.counters = {"enqueued": 0, "written": 0, "dropped": 0, "failed": 0, "flushes": 0}
+        self.last_flush_seconds = 0.0
+
+    def _count(self, name: str, n: int = 1):
+        with self._stats_lock:
+            self.counters[name] += n
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="analytics-writer", daemon=True)
+                self._thread.start()
+
+    def log(self, event_type: str, data: dict):
+        """Queues one event, timestamped now; drops it if the queue is full."""
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait({"event_type": event_type, "data": data, "timestamp": datetime.utcnow()})
+        except queue.Full:
+            self._count("dropped")
+            return
+        self._count("enqueued")
+
+    def _flush(self, batch: list):
+        t0 = time.perf_counter()
+        try:
+            self.write(batch)
+        except Exception as e:
+            print(f"⚠️ Could not write {len(batch)} analytics events: {e}")
+            self._count("failed", len(batch))
+            return
+        self.last_flush_seconds = time.perf_counter() - t0
+        self._count("written", len(batch))
+        self._count("flushes")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                batch = [self._queue.get(timeout=self.flush_seconds)]
+            except queue.Empty:
+                continue
+            flush_at = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size and not self._stopping.is_set():
+                try:
+                    batch.append(self._queue.get(timeout=max(0, flush_at - time.monotonic())))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+        self._drain()
+
+    def _drain(self):
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._flush(batch)
+
+    def close(self, timeout: float = 10):
+        """Stops the writer thread after it has written every queued event."""
+        with self._start_lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            self._drain()
+            return
+        self._stopping.set()
+        thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            counters = dict(self.counters)
+        return {
+            "queue_depth": self._queue.qsize(),
+            "capacity": self._queue.maxsize,
+            **counters,
+            "batch_size": self.batch_size,
+            "flush_seconds": self.flush_seconds,
+            "last_flush_seconds": round(self.last_flush_seconds, 4),
+        }
+
+
+analytics_writer = AnalyticsWriter()
@@ -1,12 +1,8 @@
 # applications_agent.py - Market Applications Analysis
 
 import os
-import time
-from dotenv import load_dotenv
-from openai import OpenAI, RateLimitError
-
-load_dotenv()
-client = OpenAI()
+from backend.llm_scheduler import llm_call
+from backend.llm_client import stream_response_text
 
 # You'll need to create a new stored prompt for applications
 PROMPT_ID = "pmpt_68bfa6572d8c8197b5760c5faa41969800c1ea839cdcb54f"  # Update this with new prompt ID
@@ -17,27 +13,28 @@ TOOLS = [
 ]
 
 def get_market_applications(industry: str, retries: int = 3) -> str:
-    for attempt in range(retries):
-        try:
-            print(f"Fetching applications for {industry} [attempt {attempt+1}]")
-            response = client.responses.create(
-                prompt={
-                        "id": PROMPT_ID,
-                        "version": PROMPT_VERSION
-                        },
-                input=industry,      # <-- just a string, not {"submarket": submarket}
-                temperature=0.3
-            )
-            final = next((o for o in response.output if getattr(o, "type", "") == "message"), None)
-            return "".join(part.text for part in final.content).strip() if final else "⚠️ No output returned."
-        except RateLimitError:
-            delay = 3 + attempt * 2
-            print(f"⚠️ Rate limit hit. Retrying in {delay}s...")
-            time.sleep(delay)
-        except Exception as e:
-            print(f" Error: {e}")
-            break
-    return "⚠️ Failed to retrieve market Applications"
+    print(f"Fetching applications for {industry}")
+    response = llm_call(lambda c: c.responses.create(
+        prompt={
+                "id": PROMPT_ID,
+                "version": PROMPT_VERSION
+                },
+        input=industry,      # <-- just a string, not {"submarket": submarket}
+        temperature=0.3
+    ), attempts=retries, agent="applications", label=f"market applications for {industry}")
+    final = next((o for o in response.output if getattr(o, "type", "") == "message"), None)
+    return "".join(part.text for part in final.content).strip() if final else "⚠️ No output returned."
+
+def stream_market_applications(industry: str):
+    """Streaming variant of get_market_applications: yields text deltas as the model produces them."""
+    yield from stream_response_text(
+        prompt={
+            "id": PROMPT_ID,
+            "version": PROMPT_VERSION
+        },
+        input=industry,
+        temperature=0.3
+    )
 
 def main():
     '''
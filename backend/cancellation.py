@@ -0,0 +1,115 @@
+# cancellation.py - Stops blocking LLM work once the request waiting for it has gone away
+
+import asyncio
+import threading
+import contextvars
+from contextvars import ContextVar
+
+# How often waits inside worker threads look for a cancellation
+CANCEL_POLL_SECONDS = 0.25
+
+_stats_lock = threading.Lock()
+cancel_stats = {"disconnects": 0, "worker_calls": 0, "streams": 0}
+
+
+def count_cancellation(name: str):
+    with _stats_lock:
+        cancel_stats[name] += 1
+
+
+def cancellation_stats() -> dict:
+    with _stats_lock:
+        return dict(cancel_stats)
+
+
+class Cancelled(Exception):
+    """Raised in a worker thread when nobody is waiting for its result any more."""
+
+
+class CancelToken:
+    """Thread-safe flag set when the coroutine awaiting a worker call is cancelled."""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: float) -> bool:
+        """Sleeps for up to timeout seconds; returns True early if cancelled."""
+        return self._event.wait(timeout)
+
+
+# Token of the worker call running in this context; run_agent sets a fresh one
+current_cancel = ContextVar("cancel_token", default=None)
+
+
+def raise_if_cancelled(what: str = "work"):
+    token = current_cancel.get()
+    if token is not None and token.cancelled():
+        raise Cancelled(f"{what} cancelled: client disconnected")
+
+
+def bind_context(func):
+    """
+    Wraps func to run in a copy of the caller's context variables, so tasks
+    handed to a nested thread pool still see the cancel token and priority.
+    """
+    ctx = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # A context can only be entered by one thread at a time
+        return ctx.copy().run(func, *args, **kwargs)
+    return run
+
+
+class CancelOnDisconnect:
+    """
+    ASGI middleware that cancels a request's handler when the client
+    disconnects before the response has been sent, so awaited agent calls
+    (and through run_agent, the worker threads behind them) stop early.
+    It reads the request body on the handler's behalf, one message at a
+    time, so it can see the disconnect without racing the handler.
+    """
+
+    def __init__(self, app, methods=("POST",)):
+        self.app = app
+        self.methods = set(methods)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in self.methods:
+            return await self.app(scope, receive, send)
+
+        messages = asyncio.Queue(maxsize=1)
+        state = {"responded": False, "disconnected": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                state["responded"] = True
+            await send(message)
+
+        handler = asyncio.ensure_future(self.app(scope, messages.get, send_wrapper))
+
+        async def watch():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    if not state["responded"] and not handler.done():
+                        state["disconnected"] = True
+                        count_cancellation("disconnects")
+                        handler.cancel()
+                    while True:  # anything still listening sees the disconnect
+                        await messages.put(message)
+                await messages.put(message)
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not state["disconnected"]:
+                raise
+        finally:
+            watcher.cancel()
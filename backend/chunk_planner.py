@@ -0,0 +1,82 @@
+# chunk_planner.py - Packs PDF pages into chunks under a model token budget
+
+import os
+from difflib import SequenceMatcher
+
+# Estimated input tokens allowed per chunk sent to the model
+CHUNK_TOKEN_BUDGET = int(os.getenv("CHUNK_TOKEN_BUDGET", "60000"))
+# The Files API accepts at most 100 pages per PDF input
+CHUNK_MAX_PAGES = int(os.getenv("CHUNK_MAX_PAGES", "100"))
+# Every PDF page is also sent to the model as a rendered image
+PAGE_IMAGE_TOKENS = int(os.getenv("PAGE_IMAGE_TOKENS", "800"))
+CHARS_PER_TOKEN = 4
+
+
+def estimate_page_tokens(text: str) -> int:
+    """Rough input cost of one page: its extracted text plus the page image."""
+    return len(text.strip()) // CHARS_PER_TOKEN + PAGE_IMAGE_TOKENS
+
+
+def plan_chunks(page_tokens: list, budget: int = CHUNK_TOKEN_BUDGET, max_pages: int = CHUNK_MAX_PAGES) -> list:
+    """
+    Greedily packs consecutive pages into 0-based, end-exclusive (start, end)
+    ranges whose estimated tokens stay within budget. A single page over the
+    budget gets a chunk of its own.
+    """
+    ranges = []
+    start, used = 0, 0
+    for page, tokens in enumerate(page_tokens):
+        if page > start and (used + tokens > budget or page - start >= max_pages):
+            ranges.append((start, page))
+            start, used = page, 0
+        used += tokens
+    if page_tokens:
+        ranges.append((start, len(page_tokens)))
+    return ranges
+
+
+def plan_with_reuse(page_tokens: list, fingerprints: list, base_fingerprints: list, base_chunks: list,
+                    budget: int = CHUNK_TOKEN_BUDGET, max_pages: int = CHUNK_MAX_PAGES) -> tuple:
+    """
+    Plans chunks for a revised document given an earlier version's page
+    fingerprints and chunks. Earlier chunks whose pages all appear unchanged,
+    in order, in the new document are carried over as-is; only the pages in
+    between are packed into new chunks. Returns (ranges, reused) where reused
+    maps a range's start to the earlier chunk dict it reuses.
+    """
+    matcher = SequenceMatcher(None, base_fingerprints, fingerprints, autojunk=False)
+    blocks = [b for b in matcher.get_matching_blocks() if b.size]
+    carried = []
+    for chunk in base_chunks:
+        start, end = chunk["start"] - 1, chunk["end"]
+        for a, b, size in blocks:
+            if a <= start and end <= a + size:
+                carried.append((b + start - a, b + end - a, chunk))
+                break
+    carried.sort(key=lambda item: item[0])
+
+    ranges, reused, cursor = [], {}, 0
+    def plan_gap(gap_end):
+        ranges.extend((cursor + s, cursor + e) for s, e in plan_chunks(page_tokens[cursor:gap_end], budget, max_pages))
+    for start, end, chunk in carried:
+        if start < cursor:
+            continue
+        plan_gap(start)
+        ranges.append((start, end))
+        reused[start] = chunk
+        cursor = end
+    plan_gap(len(page_tokens))
+    return ranges, reused
+
+
+def describe_plan(ranges: list, page_tokens: list, budget: int = CHUNK_TOKEN_BUDGET) -> dict:
+    """Summary of a chunk plan for logs and API responses (pages are 1-based)."""
+    chunks = [{"start": s + 1, "end": e, "estimated_tokens": sum(page_tokens[s:e])} for s, e in ranges]
+    total = sum(page_tokens)
+    return {
+        "budget_tokens": budget,
+        "pages": len(page_tokens),
+        "chunks": chunks,
+        "estimated_tokens": total,
+        "fill_ratio": round(total / (budget * len(chunks)), 3) if chunks else 0,
+    }
@@ -1,25 +1,20 @@
 import os
-from openai import OpenAI
-from dotenv import load_dotenv
+from backend.llm_scheduler import llm_call
 
 
-# Load environment variables (ensure OPENAI_API_KEY is set)
-load_dotenv()
-client = OpenAI()
-
 # ID and version of your stored prompt template
 PROMPT_ID = "pmpt_68842d6c0b448196a868674711e6639409c9f231eee31359"
 PROMPT_VERSION = "3"
 
 def get_top_companies(submarket: str) -> str:
-    response = client.responses.create(
+    response = llm_call(lambda c: c.responses.create(
         prompt={
             "id": PROMPT_ID,
             "version": PROMPT_VERSION
         },
         input=submarket,      # <-- just a string, not {"submarket": submarket}
         temperature=0.3
-    )
+    ), agent="top_companies", label=f"top companies for {submarket}")
 
     for item in response.output:
         if getattr(item, "type", "") == "message":
@@ -1,44 +1,102 @@
 # compare_pdf_agent.py
-import time
-from openai import OpenAI
 import os
-from dotenv import load_dotenv
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from backend.pdf_chunks_util import split_pdf_to_chunks
+from backend.split_and_upload_chunks import upload_chunk
+from backend.query_uploaded_chunks import ask_file, normalize_question
+from backend.cancellation import Cancelled, bind_context, raise_if_cancelled
+from backend.rate_limiter import document_limiter
+from backend.llm_scheduler import llm_call, BATCH
 
-load_dotenv()
-client = OpenAI()
-
-def compare_uploaded_pdfs(pdf_files: list, user_prompt: str) -> dict:
-    results = {}
-
-    for file in pdf_files:
-        file_name = file.name
-        chunks = split_pdf_to_chunks(file, chunk_size=50)
-        chunk_outputs = []
-
-        for (start, end, path) in chunks:
-            with open(path, "rb") as f:
-                uploaded = client.files.create(file=f, purpose="user_data")
-
-            try:
-                response = client.responses.create(
-                    model="gpt-4o",
-                    input=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "input_file", "file_id": uploaded.id},
-                                {"type": "input_text", "text": user_prompt}
-                            ]
-                        }
-                    ]
-                )
-                chunk_outputs.append(f"**Pages {start}-{end}**\n{response.output_text.strip()}")
-            except Exception as e:
-                chunk_outputs.append(f" Error on pages {start}-{end}: {e}")
-
-            time.sleep(1.5)  # Avoid rate limits
-
-        results[file_name] = "\n\n".join(chunk_outputs)
-
-    return results
+COMPARE_CONCURRENCY = int(os.getenv("COMPARE_CONCURRENCY", "8"))
+
+SYNTHESIS_INSTRUCTIONS = (
+    "You are comparing several market research documents. Below are findings "
+    "extracted from each document for the same request. Write a comparison "
+    "that highlights where the documents agree, where they differ (figures, "
+    "forecasts, assumptions), and anything only one document covers. Refer to "
+    "documents by name.\n\nRequest: {prompt}\n\n{findings}"
+)
+
+
+def _analyze_chunk(file_name: str, start: int, end: int, data: bytes, user_prompt: str,
+                   answer_cache=None) -> str:
+    try:
+        chunk, _, _ = upload_chunk(data, start, end)
+        query_key = normalize_question(user_prompt)
+        answer = answer_cache.get(chunk["file_id"], query_key) if answer_cache else None
+        if answer is None:
+            answer = ask_file(chunk["file_id"], user_prompt, label=f"{file_name} pages {start}-{end}")
+            if answer_cache:
+                answer_cache.put(chunk["file_id"], query_key, answer)
+        return f"**Pages {start}-{end}**\n{answer}"
+    except Cancelled:
+        raise
+    except Exception as e:
+        return f" Error on pages {start}-{end}: {e}"
+
+
+def _synthesize(results: dict, user_prompt: str, retries: int = 3) -> str:
+    findings = "\n\n".join(f"## {name}\n{text}" for name, text in results.items())
+    prompt = SYNTHESIS_INSTRUCTIONS.format(prompt=user_prompt, findings=findings)
+    try:
+        raw = llm_call(lambda c: c.responses.with_raw_response.create(model="gpt-4o", input=prompt),
+                       priority=BATCH, attempts=retries, agent="compare_synthesis", label="comparison synthesis",
+                       limiter=document_limiter)
+    except Exception as e:
+        return f" Error building comparison: {e}"
+    return raw.parse().output_text.strip()
+
+
+def compare_uploaded_pdfs(pdf_files: list, user_prompt: str, on_progress=None, answer_cache=None) -> dict:
+    """
+    Compares documents given as (name, source) pairs, where source is a file
+    path or readable stream. Every (file, chunk) pair is uploaded (or reused
+    from the remote file registry, e.g. after upload-and-split) and queried
+    concurrently under one COMPARE_CONCURRENCY budget; per-file findings are
+    then synthesized into a cross-document comparison. Documents are chunked
+    with the same token-budget planner as upload-and-split, so chunks of an
+    already-uploaded document are reused. With an answer_cache (get/put by
+    file_id and normalized question, as for query_chunks), chunk findings are
+    cached as they finish, so a comparison that is cancelled and retried only
+    asks the chunks it had not reached.
+
+    on_progress, if given, is called from worker threads with a dict for each
+    finished chunk and once more for the synthesis.
+    """
+    progress_lock = threading.Lock()
+    progress = {"completed": 0, "total": 0}
+
+    def report(event: dict):
+        if on_progress:
+            on_progress(event)
+
+    def run(file_name, start, end, data):
+        raise_if_cancelled("comparison")
+        text = _analyze_chunk(file_name, start, end, data, user_prompt, answer_cache)
+        with progress_lock:
+            progress["completed"] += 1
+            event = {"type": "chunk", "file": file_name, "start": start, "end": end, "text": text,
+                     "completed": progress["completed"], "total": progress["total"]}
+        report(event)
+        return text
+
+    pending = {}
+    plans = {}
+    task = bind_context(run)
+    with ThreadPoolExecutor(max_workers=COMPARE_CONCURRENCY) as pool:
+        for file_name, source in pdf_files:
+            pending[file_name] = []
+            plans[file_name] = {}
+            for start, end, data in split_pdf_to_chunks(source, plan=plans[file_name]):
+                raise_if_cancelled("comparison")
+                with progress_lock:
+                    progress["total"] += 1
+                pending[file_name].append(pool.submit(task, file_name, start, end, data))
+
+        results = {name: "\n\n".join(f.result() for f in futures) for name, futures in pending.items()}
+
+    synthesis = _synthesize(results, user_prompt) if len(results) > 1 else ""
+    report({"type": "synthesis", "text": synthesis})
+    return {"comparison_results": results, "synthesis": synthesis, "chunk_plans": plans}
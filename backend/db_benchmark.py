@@ -0,0 +1,158 @@
+# db_benchmark.py - Concurrent read/write throughput of the old default engine vs backend.database
+#
+#   python -m backend.db_benchmark [--seconds 10] [--writers 8] [--readers 32]
+#
+# Runs against a throwaway SQLite file (or BENCH_DATABASE_URL). Writers insert
+# analysis-sized rows and commit each one, like cache inserts and M&A history;
+# readers run the cached-analysis lookup. "before" is the engine the API used
+# to create, "after" is backend.database.make_engine, and "async" repeats
+# "after" with reads on the async driver (if `databases` is installed).
+
+import os
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+from sqlalchemy import (create_engine, MetaData, Table, Column, Integer, String, Text, DateTime, Index,
+                        select, insert)
+from backend.database import make_engine, Database
+
+metadata = MetaData()
+rows = Table(
+    "bench_analysis", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("market_key", String),
+    Column("analysis_type", String),
+    Column("data", Text),
+    Column("created_at", DateTime, default=datetime.utcnow),
+    Index("ix_bench_lookup", "market_key", "analysis_type", "created_at"),
+)
+MARKETS = [f"market {i}" for i in range(500)]
+PAYLOAD = "x" * 4000
+
+
+def lookup(market: str):
+    return select(rows.c.data, rows.c.created_at)\
+        .where(rows.c.market_key == market, rows.c.analysis_type == "global")\
+        .order_by(rows.c.created_at.desc()).limit(1)
+
+
+def percentile(samples: list, q: float) -> float:
+    return sorted(samples)[int(q * (len(samples) - 1))] * 1000 if samples else 0.0
+
+
+def run_threads(engine, seconds: float, writers: int, readers: int) -> dict:
+    stop = time.monotonic() + seconds
+    results = {"write": [], "read": [], "errors": 0}
+    lock = threading.Lock()
+
+    def writer():
+        while time.monotonic() < stop:
+            t0 = time.perf_counter()
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(rows), {"market_key": random.choice(MARKETS),
+                                                "analysis_type": "global", "data": PAYLOAD})
+            except Exception:
+                with lock:
+                    results["errors"] += 1
+                continue
+            with lock:
+                results["write"].append(time.perf_counter() - t0)
+
+    def reader():
+        while time.monotonic() < stop:
+            t0 = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    conn.execute(lookup(random.choice(MARKETS))).first()
+            except Exception:
+                with lock:
+                    results["errors"] += 1
+                continue
+            with lock:
+                results["read"].append(time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+async def run_async_reads(url: str, seconds: float, readers: int) -> list:
+    database = Database(url)
+    await database.connect()
+    stop = time.monotonic() + seconds
+    samples = []
+
+    async def reader():
+        while time.monotonic() < stop:
+            t0 = time.perf_counter()
+            await database.fetch_one(lookup(random.choice(MARKETS)))
+            samples.append(time.perf_counter() - t0)
+
+    await asyncio.gather(*[reader() for _ in range(readers)])
+    await database.disconnect()
+    return samples
+
+
+def report(name: str, results: dict, seconds: float):
+    for kind in ("write", "read", "async_read"):
+        samples = results.get(kind)
+        if samples is None:
+            continue
+        print(f"  {name:<8} {kind:<10} {len(samples) / seconds:9.0f} ops/s   "
+              f"p50 {percentile(samples, 0.5):7.2f} ms   p95 {percentile(samples, 0.95):7.2f} ms")
+    print(f"  {name:<8} errors     {results['errors']}")
+
+
+def bench(name: str, engine, url: str, args, async_reads: bool = False):
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(rows), [{"market_key": m, "analysis_type": "global", "data": PAYLOAD} for m in MARKETS])
+    if async_reads:
+        # Writers on pooled threads, readers on the event loop through the async driver
+        results = {}
+        writers = threading.Thread(target=lambda: results.update(run_threads(engine, args.seconds, args.writers, 0)))
+        writers.start()
+        results["async_read"] = asyncio.run(run_async_reads(url, args.seconds, args.readers))
+        writers.join()
+        del results["read"]
+    else:
+        results = run_threads(engine, args.seconds, args.writers, args.readers)
+    report(name, results, args.seconds)
+    engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=32)
+    args = parser.parse_args()
+
+    url = os.getenv("BENCH_DATABASE_URL")
+    print(f"{url or 'sqlite'}: {args.writers} writers, {args.readers} readers, {args.seconds:.0f}s per run")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # A fresh SQLite file per run: the journal mode is stored in the file
+        def database(run: str) -> str:
+            return url or f"sqlite:///{os.path.join(tmpdir, run + '.db')}"
+
+        if not url:
+            # The engine the API used before: default pool, rollback journal, no pragmas
+            bench("before", create_engine(database("before"), connect_args={"check_same_thread": False}),
+                  database("before"), args)
+        bench("after", make_engine(database("after")), database("after"), args)
+        if Database is not None:
+            bench("async", make_engine(database("async")), database("async"), args, async_reads=True)
+
+
+if __name__ == "__main__":
+    main()
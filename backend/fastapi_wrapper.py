@@ -2,19 +2,19 @@
 # fastapi_wrapper.py - DB-enabled version
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends,APIRouter, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict
-import tempfile, os, hashlib, json
+import os, json, asyncio, time
 from datetime import datetime, timedelta
 # ===== DB Setup =====
-from sqlalchemy import func
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, JSON
+from sqlalchemy import func, inspect, text, insert, select, and_, or_
+from sqlalchemy import Column, Integer, String, Text, DateTime, JSON, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
+from backend.database import (DATABASE_URL, engine, upsert, sqlite_path, fetch_one, fetch_all,
+                              connect_async, disconnect_async)
 
-DATABASE_URL = "sqlite:///./market_research.db"
-
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -30,18 +30,78 @@ class MarketAnalysis(Base):
     __tablename__ = "market_analysis"
     id = Column(Integer, primary_key=True, index=True)
     market = Column(String, index=True)
+    market_key = Column(String)  # canonical form of market, used as the cache key
     analysis_type = Column(String)  # global, vertical, horizontal
     data = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Backs the latest-fresh-row cache lookup
+        Index("ix_market_analysis_key_lookup", "market_key", "analysis_type", "created_at"),
+        # Covers the newest-first history listing, so it never reads the data blob
+        Index("ix_market_analysis_history", "created_at", "id", "market", "analysis_type"),
+    )
+
 class PDFHistory(Base):
     __tablename__ = "pdf_history"
     id = Column(Integer, primary_key=True, index=True)
     pdf_id = Column(String, unique=True, index=True)
     filename = Column(String)
     chunks = Column(JSON)
+    chunks_count = Column(Integer)  # len(chunks), so listings don't load the JSON
+    page_fingerprints = Column(JSON)  # per-page content hashes, see page_fingerprint
     processed_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Covers the newest-first history listing
+        Index("ix_pdf_history_history", "processed_at", "id", "pdf_id", "filename", "chunks_count"),
+    )
+
+class PDFPage(Base):
+    __tablename__ = "pdf_pages"
+    id = Column(Integer, primary_key=True, index=True)
+    pdf_id = Column(String, index=True)
+    page = Column(Integer)  # 1-based
+    text = Column(Text)
+    fingerprint = Column(String, index=True)
+
+class DocumentQA(Base):
+    __tablename__ = "document_qa"
+    id = Column(Integer, primary_key=True, index=True)
+    pdf_id = Column(String)
+    query_key = Column(String)  # normalized question
+    query = Column(Text)
+    answer = Column(Text)
+    mode = Column(String)  # index or scan
+    pages = Column(JSON)  # pages the answer was drawn from (index mode)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_document_qa_lookup", "pdf_id", "query_key"),
+    )
+
+class ChunkAnswer(Base):
+    __tablename__ = "chunk_answers"
+    id = Column(Integer, primary_key=True, index=True)
+    file_id = Column(String)  # remote chunk file, shared by document versions
+    query_key = Column(String)  # normalized question
+    answer = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_chunk_answers_lookup", "file_id", "query_key"),
+    )
+
+class RemoteFile(Base):
+    __tablename__ = "remote_files"
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String, unique=True, index=True)  # hash of the chunk PDF bytes
+    file_id = Column(String, index=True)  # OpenAI Files API id
+    size = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    verified_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
+
 class MAHistory(Base):
     __tablename__ = "ma_history"
     id = Column(Integer, primary_key=True, index=True)
@@ -55,31 +115,79 @@ class Analytics(Base):
     id = Column(Integer, primary_key=True, index=True)
     event_type = Column(String)
     data = Column(JSON)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
+
+class AnalyticsRollup(Base):
+    """Event counts per hour or day, event type and canonical market ("" if none)."""
+    __tablename__ = "analytics_rollups"
+    id = Column(Integer, primary_key=True, index=True)
+    granularity = Column(String)
+    bucket = Column(DateTime)
+    event_type = Column(String)
+    market = Column(String, default="")
+    count = Column(Integer, default=0)
+
+    __table_args__ = (
+        Index("ix_analytics_rollups_key", "granularity", "bucket", "event_type", "market", unique=True),
+    )
 
 Base.metadata.create_all(bind=engine)
 
+def add_missing_columns():
+    """create_all never alters existing tables, so add columns introduced since."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    col_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+
+add_missing_columns()
+# create_all skips new indexes on tables that already exist
+for table in Base.metadata.sorted_tables:
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
+
 # ===== Imports =====
 
 #Enale during deployment
 
 try:
-    from backend.openai_handler import get_vertical_submarkets
+    from backend.agent_executor import run_agent, stream_agent, shutdown_executor
+    from backend.cancellation import CancelOnDisconnect, Cancelled, cancellation_stats
+    from backend.analytics_writer import analytics_writer
+    from backend.analytics_rollup import (rollup_counts, window_buckets, bucket_start, HOUR, DAY,
+                                          ANALYTICS_RAW_RETENTION_DAYS, ANALYTICS_HOURLY_RETENTION_DAYS,
+                                          ANALYTICS_COMPACT_EVERY_SECONDS)
+    from backend.llm_client import close_client
+    from backend.llm_scheduler import scheduler, shutdown_scheduler
+    from backend.rate_limiter import document_limiter
+    from backend.singleflight import SingleFlight
+    from backend.analysis_cache import AnalysisCache, fresh_since
+    from backend.market_keys import MarketIndex, canonical_market
+    from backend.pagination import keyset_after, page_of, HISTORY_PAGE_MAX
+    from backend.openai_handler import get_vertical_submarkets, stream_vertical_submarkets
     from backend.horizontal_handler import get_horizontal_submarkets  
-    from backend.global_metrics_agent import get_global_overview
+    from backend.global_metrics_agent import get_global_overview, stream_global_overview
     from backend.metrics_agent import get_detailed_metrics
     from backend.company_agent import get_top_companies
-    from backend.mergers_agent import get_mergers_table
-    from backend.web_search_agent import search_web_insights
+    from backend.mergers_agent import get_mergers_table, stream_mergers_table
+    from backend.web_search_agent import search_web_insights, stream_web_insights
     from backend.compare_pdf_agent import compare_uploaded_pdfs
     from backend.split_and_upload_chunks import split_and_upload_pdf_chunks
-    from backend.query_uploaded_chunks import query_chunks
-    from backend.applications_agent import get_market_applications
-    from backend.technology_segments_agent import get_technology_segments
-    from backend.product_categories_agent import get_product_categories
-    from backend.regional_segments_agent import get_regional_analysis
-    from backend.end_user_segments_agent import get_end_user_analysis 
-    from backend.related_markets_agent import get_related_markets
+    from backend.pdf_chunks_util import hash_file, spool_to_disk, split_stats, shutdown_split_pool
+    from backend.query_uploaded_chunks import query_chunks, query_pages, normalize_question
+    from backend.page_index import PageIndexRegistry, PAGE_INDEX_TOP_K
+    from backend.file_registry import file_registry
+    from backend.search_index import setup_fts, match_query, matching_ids, search_query
+    from backend.applications_agent import get_market_applications, stream_market_applications
+    from backend.technology_segments_agent import get_technology_segments, stream_technology_segments
+    from backend.product_categories_agent import get_product_categories, stream_product_categories
+    from backend.regional_segments_agent import get_regional_analysis, stream_regional_analysis
+    from backend.end_user_segments_agent import get_end_user_analysis, stream_end_user_analysis
+    from backend.related_markets_agent import get_related_markets, stream_related_markets
     print("✅ Modules imported")
 except ImportError as e:
     print(f"❌ Import error: {e}")
@@ -105,6 +213,9 @@ try:
 except ImportError as e:
     print(f"❌ Import error: {e}")
 '''
+# Full-text index over cached analyses, M&A results and PDF filenames (SQLite FTS5)
+fts_enabled = setup_fts(engine)
+
 app = FastAPI(title="Market Research Intelligence API", version="3.0.0")
 
 app.add_middleware(
@@ -115,11 +226,17 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Stop agent calls and document fan-outs for clients that have gone away
+app.add_middleware(CancelOnDisconnect)
 
 # ===== Models =====
 class MarketRequest(BaseModel):
     market: str
 
+class FullReportRequest(BaseModel):
+    market: str
+    sections: Optional[List[str]] = None
+
 class SubmarketRequest(BaseModel):
     submarket: str
 
@@ -130,7 +247,10 @@ class QueryRequest(BaseModel):
 
 class DocumentQueryRequest(BaseModel):
     query: str
-    file_chunks: List[dict]
+    file_chunks: Optional[List[dict]] = None
+    pdf_id: Optional[str] = None
+    mode: Optional[str] = "auto"  # auto, index or scan
+    top_k: Optional[int] = None
 
 class MARequest(BaseModel):
     market: str
@@ -140,10 +260,57 @@ class HistoryRequest(BaseModel):
     history_type: Optional[str] = "All"
     search_term: Optional[str] = ""
     limit: Optional[int] = 20
-
-def log_analytics(db: Session, event_type: str, data: dict):
-    db.add(Analytics(event_type=event_type, data=data))
-    db.commit()
+    cursor: Optional[str] = None  # next_cursor of the previous page
+
+def add_to_rollups(session: Session, counts):
+    """Adds (granularity, bucket, event_type, market) -> n counts to the rollup table."""
+    if not counts:
+        return
+    stmt = upsert(AnalyticsRollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["granularity", "bucket", "event_type", "market"],
+        set_={"count": AnalyticsRollup.count + stmt.excluded["count"]},
+    )
+    session.execute(stmt, [
+        {"granularity": g, "bucket": bucket, "event_type": event_type, "market": market, "count": n}
+        for (g, bucket, event_type, market), n in counts.items()
+    ])
+
+analytics_compacted_at = {"at": 0.0}
+
+def compact_analytics():
+    """Deletes raw events and hourly rollups past their retention; daily rollups keep the counts."""
+    analytics_compacted_at["at"] = time.monotonic()
+    now = datetime.utcnow()
+    with SessionLocal() as session:
+        raw = session.query(Analytics)\
+            .filter(Analytics.timestamp < now - timedelta(days=ANALYTICS_RAW_RETENTION_DAYS))\
+            .delete(synchronize_session=False)
+        hourly = session.query(AnalyticsRollup)\
+            .filter(AnalyticsRollup.granularity == HOUR,
+                    AnalyticsRollup.bucket < now - timedelta(days=ANALYTICS_HOURLY_RETENTION_DAYS))\
+            .delete(synchronize_session=False)
+        session.commit()
+    if raw or hourly:
+        print(f"🧹 Analytics compaction: {raw} raw events, {hourly} hourly rollups removed")
+
+def write_analytics(events: list):
+    """
+    Bulk-inserts a batch of queued analytics events and adds them to the
+    hourly/daily rollups in the same transaction (runs on the writer thread).
+    """
+    with SessionLocal() as session:
+        session.execute(insert(Analytics), events)
+        add_to_rollups(session, rollup_counts(events))
+        session.commit()
+    if time.monotonic() - analytics_compacted_at["at"] >= ANALYTICS_COMPACT_EVERY_SECONDS:
+        compact_analytics()
+
+analytics_writer.write = write_analytics
+
+def log_analytics(event_type: str, data: dict):
+    """Queues an analytics event; it is written in the background within ANALYTICS_FLUSH_SECONDS."""
+    analytics_writer.log(event_type, data)
 
 # ===== Health Check =====
 @app.get("/api/health")
@@ -151,212 +318,649 @@ async def health_check():
     return {"status": "healthy", "message": "DB-backed API is running!"}
 
 # ===== Market Analysis Endpoints =====
-@app.post("/api/market/global-overview")
-async def global_overview(request: MarketRequest, db: Session = Depends(get_db)):
-    cached = db.query(MarketAnalysis)\
-               .filter_by(market=request.market, analysis_type="global")\
-               .order_by(MarketAnalysis.created_at.desc())\
-               .first()
-    if cached:
-        log_analytics(db, "market_analysis_cached", {"market": request.market})
-        return {"success": True, "data": cached.data, "cached": True}
+analysis_flight = SingleFlight()
+analysis_cache = AnalysisCache()
+market_index = MarketIndex()
+
+def latest_analysis(market_key: str, analysis_type: str):
+    """Query for the newest row for the key that is still within its analysis_type TTL."""
+    return select(MarketAnalysis.data, MarketAnalysis.created_at)\
+             .where(MarketAnalysis.market_key == market_key, MarketAnalysis.analysis_type == analysis_type,
+                    MarketAnalysis.created_at >= fresh_since(analysis_type))\
+             .order_by(MarketAnalysis.created_at.desc())\
+             .limit(1)
+
+async def lookup_analysis(market_key: str, analysis_type: str, recheck: bool = False):
+    """
+    Fresh cached analysis text from the memory tier or the DB, else None.
+    recheck=True is for a second look within a request that already counted
+    its lookup, so the memory tier is peeked rather than counted again.
+    """
+    data = (analysis_cache.peek if recheck else analysis_cache.get)(market_key, analysis_type)
+    if data is not None:
+        return data
+    row = await fetch_one(latest_analysis(market_key, analysis_type))
+    if row:
+        analysis_cache.set(market_key, analysis_type, row["data"], row["created_at"])
+        analysis_cache.record_db_hit()
+        return row["data"]
+    return None
+
+def save_analysis(market: str, market_key: str, analysis_type: str, data: str):
+    """Stores a new analysis (blocking; call through run_agent) and primes the memory tier."""
+    with SessionLocal() as db:
+        row = MarketAnalysis(market=market, market_key=market_key, analysis_type=analysis_type, data=data)
+        db.add(row)
+        db.commit()
+        created_at = row.created_at
+    analysis_cache.set(market_key, analysis_type, data, created_at)
+    market_index.add(market_key)
+
+async def get_or_create_analysis(market: str, analysis_type: str, agent):
+    """
+    Returns (data, cached, market_key) for a market analysis. The market name is
+    resolved to a known near-duplicate key (typos only, see market_index.resolve)
+    and looked up in the in-memory tier and the DB. On a miss the analysis is
+    computed and stored under the name's own canonical key; concurrent requests
+    for that key share one agent call and one MarketAnalysis insert. A failed
+    agent call is reported as a 502 and nothing is cached.
+    """
+    key, _ = market_index.resolve(market)
+    data = await lookup_analysis(key, analysis_type)
+    if data is not None:
+        return data, True, key
+    own_key = canonical_market(market)
+
+    async def compute():
+        # A previous leader may have finished between our cache check and now
+        data = await lookup_analysis(own_key, analysis_type, recheck=True)
+        if data is not None:
+            return data
+        result = await run_agent(agent, market)
+        await run_agent(save_analysis, market, own_key, analysis_type, result)
+        return result
 
-    result = get_global_overview(request.market)
-    db.add(MarketAnalysis(market=request.market, analysis_type="global", data=result))
-    db.commit()
-    log_analytics(db, "market_analysis", {"market": request.market})
-    return {"success": True, "data": result, "cached": False}
+    try:
+        result = await analysis_flight.do((own_key, analysis_type), compute)
+    except Cancelled:
+        raise
+    except Exception as e:
+        print(f"❌ {analysis_type} analysis for {market} failed: {e}")
+        raise HTTPException(status_code=502, detail=f"Failed to fetch {analysis_type} analysis: {e}")
+    return result, False, own_key
 
-@app.post("/api/market/vertical-segments")
-async def vertical_segments(request: MarketRequest, db: Session = Depends(get_db)):
-    cached = db.query(MarketAnalysis)\
-               .filter_by(market=request.market, analysis_type="vertical")\
-               .order_by(MarketAnalysis.created_at.desc())\
-               .first()
-    if cached:
-        return {"success": True, "data": cached.data, "cached": True}
+@app.post("/api/market/global-overview")
+async def global_overview(request: MarketRequest):
+    data, cached, market_key = await get_or_create_analysis(request.market, "global", get_global_overview)
+    log_analytics("market_analysis_cached" if cached else "market_analysis", {"market": request.market})
+    return {"success": True, "data": data, "cached": cached, "canonical_market": market_key}
 
-    result = get_vertical_submarkets(request.market)
-    db.add(MarketAnalysis(market=request.market, analysis_type="vertical", data=result))
-    db.commit()
-    return {"success": True, "data": result, "cached": False}
+@app.post("/api/market/vertical-segments")
+async def vertical_segments(request: MarketRequest):
+    data, cached, market_key = await get_or_create_analysis(request.market, "vertical", get_vertical_submarkets)
+    return {"success": True, "data": data, "cached": cached, "canonical_market": market_key}
 
 @app.post("/api/market/related-markets")
-async def related_markets(request: MarketRequest, db: Session = Depends(get_db)):
-    cached = db.query(MarketAnalysis)\
-               .filter_by(market=request.market, analysis_type="related")\
-               .order_by(MarketAnalysis.created_at.desc())\
-               .first()
-    if cached:
-        return {"success": True, "data": cached.data, "cached": True}
-
-    result = get_related_markets(request.market)
-    db.add(MarketAnalysis(market=request.market, analysis_type="related", data=result))
-    db.commit()
-    return {"success": True, "data": result, "cached": False}
+async def related_markets(request: MarketRequest):
+    data, cached, market_key = await get_or_create_analysis(request.market, "related", get_related_markets)
+    return {"success": True, "data": data, "cached": cached, "canonical_market": market_key}
 
 @app.post("/api/market/applications")
-async def market_applications(request: MarketRequest, db: Session = Depends(get_db)):
-    cached = db.query(MarketAnalysis)\
-               .filter_by(market=request.market, analysis_type="applications")\
-               .order_by(MarketAnalysis.created_at.desc())\
-               .first()
-    if cached:
-        return {"success": True, "data": cached.data, "cached": True}
+async def market_applications(request: MarketRequest):
+    data, cached, market_key = await get_or_create_analysis(request.market, "applications", get_market_applications)
+    return {"success": True, "data": data, "cached": cached, "canonical_market": market_key}
 
-    result = get_market_applications(request.market)
-    db.add(MarketAnalysis(market=request.market, analysis_type="applications", data=result))
-    db.commit()
-    return {"success": True, "data": result, "cached": False}
 '''
 @app.post("/api/market/horizontal-markets")
-async def horizontal_markets(request: MarketRequest, db: Session = Depends(get_db)):
-    cached = db.query(MarketAnalysis)\
-               .filter_by(market=request.market, analysis_type="horizontal")\
-               .order_by(MarketAnalysis.created_at.desc())\
-               .first()
-    if cached:
-        return {"success": True, "data": cached.data, "cached": True}
-
-    result = get_horizontal_submarkets(request.market)
-    db.add(MarketAnalysis(market=request.market, analysis_type="horizontal", data=result))
-    db.commit()
-    return {"success": True, "data": result, "cached": False}
+async def horizontal_markets(request: MarketRequest):
+    data, cached, market_key = await get_or_create_analysis(request.market, "horizontal", get_horizontal_submarkets)
+    return {"success": True, "data": data, "cached": cached, "canonical_market": market_key}
 '''
 @app.post("/api/market/technology-segments")
-async def technology_segments(request: MarketRequest, db: Session = Depends(get_db)):
-    cached = db.query(MarketAnalysis)\
-               .filter_by(market=request.market, analysis_type="technology_segments")\
-               .order_by(MarketAnalysis.created_at.desc())\
-               .first()
-    if cached:
-        return {"success": True, "data": cached.data, "cached": True}
-
-    result = get_technology_segments(request.market)
-    db.add(MarketAnalysis(market=request.market, analysis_type="technology_segments", data=result))
-    db.commit()
-    return {"success": True, "data": result, "cached": False}
+async def technology_segments(request: MarketRequest):
+    data, cached, market_key = await get_or_create_analysis(request.market, "technology_segments", get_technology_segments)
+    return {"success": True, "data": data, "cached": cached, "canonical_market": market_key}
 
 @app.post("/api/market/regional-analysis")
-async def regional_analysis(request: MarketRequest, db: Session = Depends(get_db)):
-    cached = db.query(MarketAnalysis)\
-               .filter_by(market=request.market, analysis_type="regional")\
-               .order_by(MarketAnalysis.created_at.desc())\
-               .first()
-    if cached:
-        return {"success": True, "data": cached.data, "cached": True}
-
-    result = get_regional_analysis(request.market)
-    db.add(MarketAnalysis(market=request.market, analysis_type="regional", data=result))
-    db.commit()
-    return {"success": True, "data": result, "cached": False}
+async def regional_analysis(request: MarketRequest):
+    data, cached, market_key = await get_or_create_analysis(request.market, "regional", get_regional_analysis)
+    return {"success": True, "data": data, "cached": cached, "canonical_market": market_key}
 
 @app.post("/api/market/end-user-analysis")
-async def end_user_analysis(request: MarketRequest, db: Session = Depends(get_db)):
-    cached = db.query(MarketAnalysis)\
-               .filter_by(market=request.market, analysis_type="end_user")\
-               .order_by(MarketAnalysis.created_at.desc())\
-               .first()
-    if cached:
-        return {"success": True, "data": cached.data, "cached": True}
-
-    result = get_end_user_analysis(request.market)
-    db.add(MarketAnalysis(market=request.market, analysis_type="end_user", data=result))
-    db.commit()
-    return {"success": True, "data": result, "cached": False}
+async def end_user_analysis(request: MarketRequest):
+    data, cached, market_key = await get_or_create_analysis(request.market, "end_user", get_end_user_analysis)
+    return {"success": True, "data": data, "cached": cached, "canonical_market": market_key}
 
 @app.post("/api/market/product-categories")
-async def product_categories(request: MarketRequest, db: Session = Depends(get_db)):
-    cached = db.query(MarketAnalysis)\
-               .filter_by(market=request.market, analysis_type="product_categories")\
-               .order_by(MarketAnalysis.created_at.desc())\
-               .first()
-    if cached:
-        return {"success": True, "data": cached.data, "cached": True}
-
-    result = get_product_categories(request.market)
-    
-    db.add(MarketAnalysis(market=request.market, analysis_type="product_categories", data=result))
-    db.commit()
-    return {"success": True, "data": result, "cached": False}
+async def product_categories(request: MarketRequest):
+    data, cached, market_key = await get_or_create_analysis(request.market, "product_categories", get_product_categories)
+    return {"success": True, "data": data, "cached": cached, "canonical_market": market_key}
+
+# analysis_type -> agent, in the order the dashboard lays out a full report
+ANALYSIS_AGENTS = {
+    "global": get_global_overview,
+    "vertical": get_vertical_submarkets,
+    "applications": get_market_applications,
+    "technology_segments": get_technology_segments,
+    "product_categories": get_product_categories,
+    "regional": get_regional_analysis,
+    "end_user": get_end_user_analysis,
+    "related": get_related_markets,
+}
+
+@app.post("/api/market/full-report")
+async def full_report(request: FullReportRequest):
+    """
+    Runs every analysis for a market concurrently and streams each section as
+    one NDJSON line as soon as it is ready. Cached sections come back first;
+    total latency is that of the slowest agent.
+    """
+    sections = request.sections or list(ANALYSIS_AGENTS)
+    unknown = [s for s in sections if s not in ANALYSIS_AGENTS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown sections: {unknown}")
+
+    async def run_section(analysis_type: str) -> dict:
+        try:
+            data, cached, market_key = await get_or_create_analysis(
+                request.market, analysis_type, ANALYSIS_AGENTS[analysis_type])
+            return {"section": analysis_type, "success": True, "data": data,
+                    "cached": cached, "canonical_market": market_key}
+        except HTTPException as e:
+            return {"section": analysis_type, "success": False, "error": e.detail}
+        except Exception as e:
+            return {"section": analysis_type, "success": False, "error": str(e)}
+
+    async def stream():
+        tasks = [asyncio.ensure_future(run_section(t)) for t in sections]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done) + "\n"
+            yield json.dumps({"done": True, "sections": len(sections)}) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+ANALYSIS_STREAMERS = {
+    "global": stream_global_overview,
+    "vertical": stream_vertical_submarkets,
+    "applications": stream_market_applications,
+    "technology_segments": stream_technology_segments,
+    "product_categories": stream_product_categories,
+    "regional": stream_regional_analysis,
+    "end_user": stream_end_user_analysis,
+    "related": stream_related_markets,
+}
+
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def sse_text_stream(gen_func, *args, on_complete=None):
+    """
+    Relays a blocking text-delta generator as Server-Sent Events: one "delta"
+    event per chunk, then "done" (or "error"). on_complete receives the full
+    text once the model has finished.
+    """
+    parts = []
+    try:
+        async for delta in stream_agent(gen_func, *args):
+            parts.append(delta)
+            yield sse("delta", {"text": delta})
+    except Exception as e:
+        yield sse("error", {"message": str(e)})
+        return
+    result = "".join(parts).strip()
+    if on_complete:
+        await run_agent(on_complete, result)
+    yield sse("done", {"cached": False})
+
+@app.post("/api/market/stream/{analysis_type}")
+async def stream_market_analysis(analysis_type: str, request: MarketRequest):
+    """SSE variant of the /api/market/* endpoints; persists the full text when done."""
+    if analysis_type not in ANALYSIS_STREAMERS:
+        raise HTTPException(status_code=404, detail=f"Unknown analysis type: {analysis_type}")
+    key, _ = market_index.resolve(request.market)
+    data = await lookup_analysis(key, analysis_type)
+
+    async def cached_stream():
+        yield sse("delta", {"text": data})
+        yield sse("done", {"cached": True, "canonical_market": key})
+
+    def persist(result: str):
+        save_analysis(request.market, canonical_market(request.market), analysis_type, result)
+
+    if data is not None:
+        body = cached_stream()
+    else:
+        body = sse_text_stream(ANALYSIS_STREAMERS[analysis_type], request.market, on_complete=persist)
+    return StreamingResponse(body, media_type="text/event-stream")
 
 @app.post("/api/market/detailed-metrics")
 async def detailed_metrics(request: MarketRequest):
-    return {"success": True, "data": get_detailed_metrics(request.market)}
+    return {"success": True, "data": await run_agent(get_detailed_metrics, request.market)}
 
 # ===== Company Endpoint =====
 @app.post("/api/company/top-companies")
 async def top_companies(request: SubmarketRequest):
-    return {"success": True, "data": get_top_companies(request.submarket)}
+    return {"success": True, "data": await run_agent(get_top_companies, request.submarket)}
 
 # ===== Web Insights =====
 @app.post("/api/research/web-insights")
-async def web_research(request: QueryRequest, db: Session = Depends(get_db)):
-    result = search_web_insights(request.query)
-    log_analytics(db, "web_research", {"query": request.query})
+async def web_research(request: QueryRequest):
+    result = await run_agent(search_web_insights, request.query)
+    log_analytics("web_research", {"query": request.query})
     return {"success": True, "data": result}
 
-# ===== Document Upload =====
-@app.post("/api/documents/upload-and-split")
-async def upload_document(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    content = await file.read()
-    file_hash = hashlib.md5(content).hexdigest()
+@app.post("/api/research/web-insights/stream")
+async def web_research_stream(request: QueryRequest):
+    log_analytics("web_research", {"query": request.query})
+    return StreamingResponse(sse_text_stream(stream_web_insights, request.query), media_type="text/event-stream")
 
-    existing = db.query(PDFHistory).filter_by(pdf_id=file_hash).first()
-    if existing:
-        return {"success": True, "data": {"chunks": existing.chunks, "pdf_id": existing.pdf_id}}
+# ===== Document Upload =====
+class RemoteFileStore:
+    """Database-backed store for the remote file registry (see backend/file_registry.py)."""
+
+    @staticmethod
+    def _entry(row):
+        return {"file_id": row.file_id, "size": row.size, "created_at": row.created_at,
+                "verified_at": row.verified_at, "last_used_at": row.last_used_at}
+
+    def get(self, sha256: str):
+        with SessionLocal() as db:
+            row = db.query(RemoteFile).filter_by(sha256=sha256).first()
+            return self._entry(row) if row else None
+
+    def get_by_file_id(self, file_id: str):
+        with SessionLocal() as db:
+            row = db.query(RemoteFile).filter_by(file_id=file_id).first()
+            return (row.sha256, self._entry(row)) if row else None
+
+    def put(self, sha256: str, file_id: str, size: int):
+        now = datetime.utcnow()
+        with SessionLocal() as db:
+            row = db.query(RemoteFile).filter_by(sha256=sha256).first() or RemoteFile(sha256=sha256)
+            row.file_id, row.size = file_id, size
+            row.created_at = row.verified_at = row.last_used_at = now
+            db.add(row)
+            db.commit()
+
+    def touch(self, sha256: str, verified: bool = False):
+        now = datetime.utcnow()
+        values = {"last_used_at": now, "verified_at": now} if verified else {"last_used_at": now}
+        with SessionLocal() as db:
+            db.query(RemoteFile).filter_by(sha256=sha256).update(values)
+            db.commit()
+
+    def last_used(self, file_ids) -> dict:
+        if not file_ids:
+            return {}
+        with SessionLocal() as db:
+            rows = db.query(RemoteFile.file_id, RemoteFile.last_used_at).filter(RemoteFile.file_id.in_(file_ids))
+            return dict(rows.all())
+
+    def unused_since(self, cutoff: datetime) -> list:
+        with SessionLocal() as db:
+            return [r[0] for r in db.query(RemoteFile.file_id).filter(RemoteFile.last_used_at < cutoff).all()]
+
+    def delete(self, file_ids):
+        if not file_ids:
+            return
+        with SessionLocal() as db:
+            db.query(RemoteFile).filter(RemoteFile.file_id.in_(list(file_ids))).delete(synchronize_session=False)
+            db.commit()
+
+file_registry.store = RemoteFileStore()
+
+class ChunkAnswerStore:
+    """Per-chunk answers keyed by remote file_id and normalized question."""
+
+    def get(self, file_id: str, query_key: str):
+        with SessionLocal() as db:
+            row = (db.query(ChunkAnswer.answer).filter_by(file_id=file_id, query_key=query_key)
+                   .order_by(ChunkAnswer.created_at.desc()).first())
+            return row[0] if row else None
+
+    def put(self, file_id: str, query_key: str, answer: str):
+        with SessionLocal() as db:
+            db.add(ChunkAnswer(file_id=file_id, query_key=query_key, answer=answer))
+            db.commit()
+
+chunk_answers = ChunkAnswerStore()
+
+def find_base_document(fingerprints: list):
+    """
+    The stored document sharing the most pages with these fingerprints whose
+    chunk files are still live, as (page fingerprints, chunks), or None.
+    """
+    shared = {}
+    unique = list(set(fingerprints))
+    with SessionLocal() as db:
+        for i in range(0, len(unique), 500):  # stay under SQLite's bound-parameter limit
+            rows = (db.query(PDFPage.pdf_id, func.count(PDFPage.id))
+                    .filter(PDFPage.fingerprint.in_(unique[i:i + 500])).group_by(PDFPage.pdf_id).all())
+            for pdf_id, count in rows:
+                shared[pdf_id] = shared.get(pdf_id, 0) + count
+        for pdf_id in sorted(shared, key=shared.get, reverse=True)[:3]:
+            base = db.query(PDFHistory.page_fingerprints, PDFHistory.chunks).filter_by(pdf_id=pdf_id).first()
+            if base and base.page_fingerprints and file_registry.all_alive([c["file_id"] for c in base.chunks]):
+                print(f"♻️ Reusing chunks of {pdf_id} ({shared[pdf_id]} shared pages)")
+                return base.page_fingerprints, base.chunks
+    return None
+
+async def chunks_alive(chunks: list) -> bool:
+    """True if every chunk's remote file still exists (registry-cached checks)."""
+    return await run_agent(file_registry.all_alive, [c["file_id"] for c in chunks or []])
+
+def referenced_file_ids() -> set:
+    with SessionLocal() as db:
+        return {c["file_id"] for (chunks,) in db.query(PDFHistory.chunks).all() for c in chunks or []}
+
+def collect_remote_files(candidates: list) -> list:
+    """Deletes remote chunk files no stored document references any more."""
+    return file_registry.collect_garbage(referenced_file_ids(), candidates)
+
+upload_flight = SingleFlight()
+
+def stored_document(pdf_id: str):
+    """Query for a stored document's id and chunks."""
+    return select(PDFHistory.pdf_id, PDFHistory.chunks).where(PDFHistory.pdf_id == pdf_id)
+
+def save_document(pdf_id: str, filename: str, chunks: list, fingerprints: list, page_texts: list, repair: bool):
+    """
+    Stores a split document and its page texts (blocking; call through
+    run_agent). repair replaces the chunks and pages of an existing row.
+    """
+    with SessionLocal() as session:
+        if repair:
+            session.query(PDFHistory).filter_by(pdf_id=pdf_id).update(
+                {"chunks": chunks, "chunks_count": len(chunks), "page_fingerprints": fingerprints})
+            session.query(PDFPage).filter_by(pdf_id=pdf_id).delete(synchronize_session=False)
+        else:
+            session.add(PDFHistory(pdf_id=pdf_id, filename=filename, chunks=chunks,
+                                   chunks_count=len(chunks), page_fingerprints=fingerprints))
+        session.bulk_insert_mappings(PDFPage, [
+            {"pdf_id": pdf_id, "page": i + 1, "text": text, "fingerprint": fingerprint}
+            for i, (text, fingerprint) in enumerate(zip(page_texts, fingerprints))
+        ])
+        session.commit()
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-        tmp.write(content)
-        tmp_path = tmp.name
+@app.post("/api/documents/upload-and-split")
+async def upload_document(file: UploadFile = File(...)):
+    """
+    Splits and uploads a PDF. Starlette has already spooled the body to its
+    own temp file by the time this runs; its MD5 is computed in place, so a
+    known document returns without another copy. Only a new document is
+    copied to a named temp file for the splitter processes.
+    A known document whose remote chunk files have disappeared is re-split and
+    only the missing chunks are uploaded again. A revised version of a stored
+    document (matched by page fingerprints) carries over the earlier version's
+    chunks, and with them their cached answers, for unchanged page runs.
+    """
+    file_hash, _ = await run_agent(hash_file, file.file)
+    existing = await fetch_one(stored_document(file_hash))
+    if existing and await chunks_alive(existing["chunks"]):
+        return {"success": True, "data": {"chunks": existing["chunks"], "pdf_id": existing["pdf_id"]}}
+
+    tmp_path, _, _ = await run_agent(spool_to_disk, file.file)
+    owned_by_flight = False
+    try:
 
-    class FileStream:
-        def read(self): return open(tmp_path, 'rb').read()
+        async def process():
+            row = await fetch_one(stored_document(file_hash))
+            if row and await chunks_alive(row["chunks"]):
+                return row["chunks"], None
+
+            timings, page_texts, fingerprints = {}, [], []
+            chunks = await run_agent(split_and_upload_pdf_chunks, tmp_path, timings, page_texts,
+                                     fingerprints, find_base_document)
+            print(f"📄 {file.filename}: {len(chunks)} chunks ({timings['carried_over']} carried over, "
+                  f"fill {timings['plan']['fill_ratio']}), {timings['uploaded']} uploaded in {timings['wall_seconds']}s")
+            await run_agent(save_document, file_hash, file.filename, chunks, fingerprints, page_texts,
+                            row is not None)
+            return chunks, timings
+
+        def start():
+            # The leader's spooled file belongs to the shared task, which may
+            # outlive the leader (followers keep it running), so the task
+            # removes it when done; every other caller removes its own copy.
+            nonlocal owned_by_flight
+            owned_by_flight = True
+            task = asyncio.ensure_future(process())
+            task.add_done_callback(lambda _: os.unlink(tmp_path))
+            return task
+
+        # Concurrent uploads of the same file split and upload only once
+        chunks, timings = await upload_flight.do(file_hash, start)
+    finally:
+        if not owned_by_flight:
+            os.unlink(tmp_path)
+    return {"success": True, "data": {"chunks": chunks, "pdf_id": file_hash, "timings": timings}}
 
-    chunks = split_and_upload_pdf_chunks(FileStream())
-    pdf_id = file_hash
-    db.add(PDFHistory(pdf_id=pdf_id, filename=file.filename, chunks=chunks))
-    db.commit()
-    os.unlink(tmp_path)
-    return {"success": True, "data": {"chunks": chunks, "pdf_id": pdf_id}}
+def load_page_texts(pdf_id: str, pages: list = None):
+    """Extracted page texts for a document in page order, or None if not indexed."""
+    db = SessionLocal()
+    try:
+        query = db.query(PDFPage.page, PDFPage.text).filter(PDFPage.pdf_id == pdf_id)
+        if pages is not None:
+            query = query.filter(PDFPage.page.in_(pages))
+        rows = query.order_by(PDFPage.page).all()
+    finally:
+        db.close()
+    if not rows:
+        return None
+    return [text or "" for _, text in rows] if pages is None else list(rows)
+
+page_indexes = PageIndexRegistry(load_page_texts)
+
+qa_flight = SingleFlight()
+
+async def answer_document_query(request: DocumentQueryRequest, file_chunks: list):
+    """Runs the question against the page index or every chunk; returns (answer, mode, pages)."""
+    if request.mode != "scan" and request.pdf_id:
+        index = await run_agent(page_indexes.get, request.pdf_id)
+        hits = index.search(request.query, request.top_k or PAGE_INDEX_TOP_K) if index and index.searchable else []
+        if hits:
+            pages = await run_agent(load_page_texts, request.pdf_id, [page for page, _ in hits])
+            result = await run_agent(query_pages, request.query, pages)
+            return result, "index", sorted(p for p, _ in hits)
+    if request.mode == "index":
+        raise HTTPException(status_code=422, detail="No page index match for this document; use scan mode")
+
+    result = await run_agent(query_chunks, request.query, file_chunks, chunk_answers)
+    return result, "scan", None
+
+def cached_answer(pdf_id: str, query_key: str, mode: str):
+    """Query for the newest stored answer to a question (in mode, unless auto)."""
+    query = select(DocumentQA.answer, DocumentQA.mode, DocumentQA.pages)\
+              .where(DocumentQA.pdf_id == pdf_id, DocumentQA.query_key == query_key)
+    if mode != "auto":
+        query = query.where(DocumentQA.mode == mode)
+    return query.order_by(DocumentQA.created_at.desc()).limit(1)
+
+def save_answer(pdf_id: str, query_key: str, query: str, answer: str, mode: str, pages):
+    """Stores a document answer (blocking; call through run_agent)."""
+    with SessionLocal() as session:
+        session.add(DocumentQA(pdf_id=pdf_id, query_key=query_key, query=query, answer=answer, mode=mode,
+                               pages=pages))
+        session.commit()
 
 @app.post("/api/documents/query")
 async def query_document(request: DocumentQueryRequest):
-    result = query_chunks(request.query, request.file_chunks)
-    return {"success": True, "data": result}
+    """
+    Answers a question about an uploaded document, identified by pdf_id (the
+    server looks up its chunks) or, for older clients, by file_chunks.
+
+    In "index" mode (and in "auto" mode when the document has a usable text
+    index) pages are ranked with BM25 and only the top_k pages are sent to the
+    model. "scan" mode, and "auto" for scanned or unindexed documents, asks
+    every chunk. Answers are cached per (pdf_id, normalized question).
+    """
+    if request.mode not in ("auto", "index", "scan"):
+        raise HTTPException(status_code=400, detail="mode must be auto, index or scan")
+    if not request.pdf_id:
+        if not request.file_chunks:
+            raise HTTPException(status_code=400, detail="pdf_id or file_chunks is required")
+        result, mode, pages = await answer_document_query(request, request.file_chunks)
+        return {"success": True, "data": result, "mode": mode, "pages": pages, "cached": False}
+
+    pdf = await fetch_one(stored_document(request.pdf_id))
+    if not pdf:
+        raise HTTPException(status_code=404, detail="PDF session not found")
+    file_chunks = pdf["chunks"]
+    query_key = normalize_question(request.query)
+    cached = await fetch_one(cached_answer(request.pdf_id, query_key, request.mode))
+    if cached:
+        return {"success": True, "data": cached["answer"], "mode": cached["mode"], "pages": cached["pages"],
+                "cached": True}
+
+    async def compute():
+        result, mode, pages = await answer_document_query(request, file_chunks)
+        # Don't pin a partial failure in the cache
+        if "Error on pages" not in result:
+            await run_agent(save_answer, request.pdf_id, query_key, request.query, result, mode, pages)
+        return result, mode, pages
+
+    result, mode, pages = await qa_flight.do((request.pdf_id, query_key, request.mode), compute)
+    return {"success": True, "data": result, "mode": mode, "pages": pages, "cached": False}
+
+async def spool_uploads(files: List[UploadFile]) -> list:
+    """Spools each uploaded file to disk; returns (filename, path) pairs."""
+    spooled = []
+    for file in files:
+        path, _, _ = await run_agent(spool_to_disk, file.file)
+        spooled.append((file.filename, path))
+    return spooled
 
 @app.post("/api/documents/compare")
 async def compare_documents(files: List[UploadFile] = File(...), prompt: str = Form(...)):
-    file_objects = []
-    for file in files:
-        content = await file.read()
-        class FileObj:
-            def __init__(self, name, content): self.name, self._content = name, content
-            def read(self): return self._content
-        file_objects.append(FileObj(file.filename, content))
-
-    result = compare_uploaded_pdfs(file_objects, prompt)
+    spooled = await spool_uploads(files)
+    try:
+        result = await run_agent(compare_uploaded_pdfs, spooled, prompt, None, chunk_answers)
+    finally:
+        for _, path in spooled:
+            os.unlink(path)
     return {"success": True, "data": result}
 
+@app.post("/api/documents/compare/stream")
+async def compare_documents_stream(files: List[UploadFile] = File(...), prompt: str = Form(...)):
+    """
+    NDJSON variant of /api/documents/compare: one line per finished chunk as
+    it completes, one for the synthesis, then a final line with the full result.
+    """
+    spooled = await spool_uploads(files)
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def on_progress(event: dict):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    async def stream():
+        job = asyncio.ensure_future(run_agent(compare_uploaded_pdfs, spooled, prompt, on_progress, chunk_answers))
+        try:
+            while not (job.done() and events.empty()):
+                getter = asyncio.ensure_future(events.get())
+                await asyncio.wait([getter, job], return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield json.dumps(getter.result()) + "\n"
+                else:
+                    getter.cancel()
+            try:
+                yield json.dumps({"type": "done", "data": job.result()}) + "\n"
+            except Exception as e:
+                yield json.dumps({"type": "error", "message": str(e)}) + "\n"
+        finally:
+            # Client gone before the end: stop the remaining chunk work. Workers
+            # still splitting keep their open handles to the spooled files.
+            job.cancel()
+            for _, path in spooled:
+                os.unlink(path)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 # ===== M&A Endpoints =====
+def record_ma_search(market: str, timeframe: str, result: str):
+    with SessionLocal() as session:
+        session.add(MAHistory(market=market, timeframe=timeframe, result=result))
+        session.commit()
+
 @app.post("/api/ma/analyze-deals")
-async def ma_deals(request: MARequest, db: Session = Depends(get_db)):
-    result = get_mergers_table(request.market, request.timeframe)
-    db.add(MAHistory(market=request.market, timeframe=request.timeframe, result=result))
-    db.commit()
+async def ma_deals(request: MARequest):
+    result = await run_agent(get_mergers_table, request.market, request.timeframe)
+    await run_agent(record_ma_search, request.market, request.timeframe, result)
     return {"success": True, "data": result}
 
+@app.post("/api/ma/analyze-deals/stream")
+async def ma_deals_stream(request: MARequest):
+    def persist(result: str):
+        record_ma_search(request.market, request.timeframe, result)
+
+    body = sse_text_stream(stream_mergers_table, request.market, request.timeframe, on_complete=persist)
+    return StreamingResponse(body, media_type="text/event-stream")
+
 @app.get("/api/ma/recent-searches")
 async def get_recent_ma_searches(limit: int = 10, db: Session = Depends(get_db)):
     rows = db.query(MAHistory).order_by(MAHistory.timestamp.desc()).limit(limit).all()
     return {"success": True, "data": [r.__dict__ for r in rows]}
 
 # ===== Startup =====
+def load_market_keys():
+    """Backfills market_key on older rows and seeds the fuzzy market index."""
+    db = SessionLocal()
+    try:
+        for (market,) in db.query(MarketAnalysis.market).filter(MarketAnalysis.market_key.is_(None)).distinct():
+            db.query(MarketAnalysis).filter(MarketAnalysis.market == market, MarketAnalysis.market_key.is_(None))\
+              .update({"market_key": canonical_market(market)}, synchronize_session=False)
+        db.commit()
+        for (key,) in db.query(MarketAnalysis.market_key).distinct():
+            market_index.add(key)
+    finally:
+        db.close()
+    print("🔑 Known markets:", len(market_index))
+
+def backfill_analytics_rollups():
+    """Builds the rollups from raw events once, for databases that predate them."""
+    with SessionLocal() as session:
+        if session.query(AnalyticsRollup.id).first() or not session.query(Analytics.id).first():
+            return
+        events = session.query(Analytics.event_type, Analytics.data, Analytics.timestamp).yield_per(5000)
+        counts = rollup_counts(row._asdict() for row in events)
+        add_to_rollups(session, counts)
+        session.commit()
+    print("📈 Analytics rollups backfilled:", len(counts))
+
+def backfill_chunks_count():
+    """Fills chunks_count on rows that predate the column."""
+    with SessionLocal() as session:
+        updated = session.query(PDFHistory).filter(PDFHistory.chunks_count.is_(None))\
+                         .update({"chunks_count": func.coalesce(func.json_array_length(PDFHistory.chunks), 0)},
+                                 synchronize_session=False)
+        session.commit()
+    if updated:
+        print("🧮 chunks_count backfilled:", updated)
+
 @app.on_event("startup")
 async def startup_event():
     print("🚀 DB-backed API started!")
     print("📊 DB path:", DATABASE_URL)
     print("✅ Tables:", Base.metadata.tables.keys())
+    load_market_keys()
+    backfill_chunks_count()
+    await connect_async()
+    backfill_analytics_rollups()
+    compact_analytics()
+    analytics_writer.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await run_agent(analytics_writer.close)
+    shutdown_executor()
+    shutdown_split_pool()
+    shutdown_scheduler()
+    close_client()
+    await disconnect_async()
+
 @app.get("/api/admin/database-stats")
 async def get_database_stats(db: Session = Depends(get_db)):
     return {
@@ -366,60 +970,192 @@ async def get_database_stats(db: Session = Depends(get_db)):
             "pdf_history_count": db.query(PDFHistory).count(),
             "ma_searches_count": db.query(MAHistory).count(),
             "usage_analytics_count": db.query(Analytics).count(),
-            "db_size_mb": os.path.getsize("./market_research.db") / (1024 * 1024),
+            "db_size_mb": os.path.getsize(sqlite_path()) / (1024 * 1024) if sqlite_path() else None,
             "tables": list(Base.metadata.tables.keys())
         }
     }
 
+@app.get("/api/admin/cache-stats")
+async def get_cache_stats():
+    return {
+        "success": True,
+        "data": {
+            "analysis_cache": analysis_cache.stats(),
+            "remote_files": file_registry.stats(),
+            "splitting": split_stats(),
+            "in_flight": {
+                "analysis": analysis_flight.in_flight(),
+                "uploads": upload_flight.in_flight(),
+            },
+            "coalesced": {
+                "analysis": analysis_flight.stats,
+                "uploads": upload_flight.stats,
+            },
+        }
+    }
+
+@app.get("/api/admin/llm-scheduler")
+async def get_llm_scheduler_stats():
+    """
+    Queue depth, running calls, retries, cancellations and admission waits
+    per priority class, plus per-agent latency percentiles, deadlines,
+    hedging counts and client-disconnect cancellations.
+    """
+    return {
+        "success": True,
+        "data": {
+            "scheduler": scheduler.stats(),
+            "document_rate_limiter": document_limiter.stats(),
+            "cancellations": {
+                **cancellation_stats(),
+                "abandoned_flights": {
+                    "analysis": analysis_flight.stats["abandoned"],
+                    "uploads": upload_flight.stats["abandoned"],
+                    "document_qa": qa_flight.stats["abandoned"],
+                },
+            },
+        }
+    }
+
+def rollup_window(days: float):
+    """Filter selecting the rollup rows that cover the last `days` days, to the hour."""
+    first_hour, first_day = window_buckets(datetime.utcnow(), days)
+    return or_(
+        and_(AnalyticsRollup.granularity == HOUR, AnalyticsRollup.bucket >= first_hour,
+             AnalyticsRollup.bucket < first_day),
+        and_(AnalyticsRollup.granularity == DAY, AnalyticsRollup.bucket >= first_day),
+    )
+
 @app.get("/api/admin/analytics")
 async def get_analytics(days: int = 7, db: Session = Depends(get_db)):
-    cutoff = datetime.utcnow() - timedelta(days=days)
-    rows = db.query(Analytics).filter(Analytics.timestamp >= cutoff).all()
-    event_counts = {}
-    for r in rows:
-        event_counts[r.event_type] = event_counts.get(r.event_type, 0) + 1
+    """Event counts by type and the busiest markets over the last `days` days, read from the rollups."""
+    total = func.sum(AnalyticsRollup.count)
+    in_window = rollup_window(days)
+    event_counts = dict(db.query(AnalyticsRollup.event_type, total).filter(in_window)
+                        .group_by(AnalyticsRollup.event_type).all())
+    top_markets = db.query(AnalyticsRollup.market, total).filter(in_window, AnalyticsRollup.market != "")\
+                    .group_by(AnalyticsRollup.market).order_by(total.desc()).limit(10).all()
     return {
         "success": True,
         "data": {
-            "total_events": len(rows),
-            "event_breakdown": event_counts
+            "total_events": sum(event_counts.values()),
+            "event_breakdown": event_counts,
+            "top_markets": [{"market": market, "events": n} for market, n in top_markets],
+            "ingestion": analytics_writer.stats(),
         }
     }
 
-@app.post("/api/history/market-analysis")
-async def get_market_history(request: HistoryRequest, db: Session = Depends(get_db)):
-    query = db.query(MarketAnalysis)
+@app.get("/api/admin/analytics/timeline")
+async def get_analytics_timeline(days: int = 7, granularity: str = DAY, event_type: Optional[str] = None,
+                                 market: Optional[str] = None, db: Session = Depends(get_db)):
+    """
+    Event counts per hour or day for the last `days` days, optionally for one
+    event type and/or market. Hourly buckets are kept for
+    ANALYTICS_HOURLY_RETENTION_DAYS.
+    """
+    if granularity not in (HOUR, DAY):
+        raise HTTPException(status_code=400, detail="granularity must be hour or day")
+    since = bucket_start(datetime.utcnow() - timedelta(days=days), granularity)
+    query = db.query(AnalyticsRollup.bucket, AnalyticsRollup.event_type, func.sum(AnalyticsRollup.count))\
+              .filter(AnalyticsRollup.granularity == granularity, AnalyticsRollup.bucket >= since)
+    if event_type:
+        query = query.filter(AnalyticsRollup.event_type == event_type)
+    if market:
+        query = query.filter(AnalyticsRollup.market == canonical_market(market))
+    rows = query.group_by(AnalyticsRollup.bucket, AnalyticsRollup.event_type).order_by(AnalyticsRollup.bucket).all()
+    return {
+        "success": True,
+        "data": [{"bucket": bucket.isoformat(), "event_type": kind, "count": n} for bucket, kind, n in rows]
+    }
+
+def name_filter(model, column: str, term: str):
+    """Filter for a history search box: word-prefix match on the FTS index where available, else LIKE."""
+    match = match_query(term, prefix_all=True, column=column) if fts_enabled else None
+    if match:
+        return model.id.in_(matching_ids(model.__tablename__, match))
+    return getattr(model, column).ilike(f"%{term}%")
+
+async def history_page(request: HistoryRequest, model, ts_column, query, search_column: str):
+    """
+    One newest-first page of query (a select of listing columns only). Pages
+    are keyset-paginated on (timestamp, id): pass the response's next_cursor
+    back as cursor for the next page; it is None on the last page.
+    """
+    limit = max(1, min(request.limit or 20, HISTORY_PAGE_MAX))
     if request.search_term:
-        query = query.filter(MarketAnalysis.market.ilike(f"%{request.search_term}%"))
-    rows = query.order_by(MarketAnalysis.created_at.desc()).limit(request.limit).all()
+        query = query.where(name_filter(model, search_column, request.search_term))
+    if request.cursor:
+        try:
+            query = query.where(keyset_after(ts_column, model.id, request.cursor))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    rows = await fetch_all(query.order_by(ts_column.desc(), model.id.desc()).limit(limit + 1))
+    return page_of(rows, limit, ts_column.key)
+
+@app.post("/api/history/market-analysis")
+async def get_market_history(request: HistoryRequest):
+    query = select(MarketAnalysis.id, MarketAnalysis.market, MarketAnalysis.analysis_type, MarketAnalysis.created_at)
+    rows, next_cursor = await history_page(request, MarketAnalysis, MarketAnalysis.created_at, query, "market")
 
     history = [
         {   
-            "id": r.id,
-            "market_name": r.market,
-            "query_type": r.analysis_type,
-            "created_at": r.created_at.isoformat(),
+            "id": r["id"],
+            "market_name": r["market"],
+            "query_type": r["analysis_type"],
+            "created_at": r["created_at"].isoformat(),
         } for r in rows
     ]
-    return {"success": True, "data": history}
+    return {"success": True, "data": history, "next_cursor": next_cursor}
 
 @app.post("/api/history/pdf-sessions")
-async def get_pdf_history(request: HistoryRequest, db: Session = Depends(get_db)):
-    query = db.query(PDFHistory)
-    if request.search_term:
-        query = query.filter(PDFHistory.filename.ilike(f"%{request.search_term}%"))
-    rows = query.order_by(PDFHistory.processed_at.desc()).limit(request.limit).all()
+async def get_pdf_history(request: HistoryRequest):
+    query = select(PDFHistory.id, PDFHistory.pdf_id, PDFHistory.filename, PDFHistory.chunks_count,
+                   PDFHistory.processed_at)
+    rows, next_cursor = await history_page(request, PDFHistory, PDFHistory.processed_at, query, "filename")
 
     history = [
         {   
-            "id": r.pdf_id,
-            "pdf_id": r.pdf_id,
-            "file_name": r.filename,
-            "chunks_count": len(r.chunks),
-            "processed_at": r.processed_at.isoformat(),
+            "id": r["pdf_id"],
+            "pdf_id": r["pdf_id"],
+            "file_name": r["filename"],
+            "chunks_count": r["chunks_count"],
+            "processed_at": r["processed_at"].isoformat(),
         } for r in rows
     ]
-    return {"success": True, "data": history}
+    return {"success": True, "data": history, "next_cursor": next_cursor}
+
+SEARCH_SOURCES = {"analyses": "market_analysis", "ma": "ma_history", "pdfs": "pdf_history"}
+
+@app.get("/api/search")
+async def search(q: str, types: Optional[str] = None, limit: int = 20):
+    """
+    Ranked full-text search over cached analyses (market name and text), M&A
+    results and PDF filenames. types is a comma-separated subset of analyses,
+    ma and pdfs. Words are ANDed, "quoted phrases" kept together and the last
+    word matched as a prefix; each hit carries a snippet with the matches in
+    **bold**, and hits from all sources are merged by bm25 rank.
+    """
+    if not fts_enabled:
+        raise HTTPException(status_code=503, detail="Full-text search needs SQLite with FTS5")
+    kinds = types.split(",") if types else list(SEARCH_SOURCES)
+    unknown = [k for k in kinds if k not in SEARCH_SOURCES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown types: {unknown}")
+    match = match_query(q)
+    if match is None:
+        raise HTTPException(status_code=400, detail="Search text must contain at least one word")
+    limit = max(1, min(limit, 100))
+
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*[fetch_all(search_query(SEARCH_SOURCES[k], match, limit)) for k in kinds])
+    hits = []
+    for kind, rows in zip(kinds, results):
+        for row in rows:
+            row["type"] = kind
+            row["rank"] = round(row["rank"], 4)
+            hits.append(row)
+    hits.sort(key=lambda hit: hit["rank"])
+    return {"success": True, "data": hits[:limit], "took_ms": round((time.perf_counter() - t0) * 1000, 1)}
 
 @app.get("/api/history/popular-markets")
 async def get_popular_markets(days: int = 7, limit: int = 10, db: Session = Depends(get_db)):
@@ -442,23 +1178,35 @@ async def get_popular_markets(days: int = 7, limit: int = 10, db: Session = Depe
 # ===== Restore Endpoints =====
 
 @app.post("/api/restore/market-analysis/{market_name}")
-async def restore_market_analysis(market_name: str, db: Session = Depends(get_db)):
-    """Restore complete market analysis for a market from DB"""
-    rows = db.query(MarketAnalysis).filter_by(market=market_name).all()
+async def restore_market_analysis(market_name: str):
+    """Restore complete market analysis for a market from DB (the newest row of each type)"""
+    # Resolved like get_or_create_analysis reads, so a misspelt name finds the stored market
+    market_key, _ = market_index.resolve(market_name)
+    latest = MarketAnalysis.__table__.alias("latest")
+    newest = select(func.max(MarketAnalysis.created_at)).where(
+        MarketAnalysis.market_key == market_key, MarketAnalysis.analysis_type == latest.c.analysis_type
+    ).scalar_subquery()
+    rows = await fetch_all(select(latest.c.analysis_type, latest.c.data)
+                           .where(latest.c.market_key == market_key, latest.c.created_at == newest))
     if not rows:
         raise HTTPException(status_code=404, detail="Market analysis not found")
 
     restored_data = {}
     for row in rows:
-        restored_data[row.analysis_type] = row.data
+        restored_data[row["analysis_type"]] = row["data"]
 
-    return {"success": True, "data": restored_data}
+    return {"success": True, "data": restored_data, "canonical_market": market_key}
 
 
 @app.post("/api/restore/pdf-session/{pdf_id}")
-async def restore_pdf_session(pdf_id: str, db: Session = Depends(get_db)):
+async def restore_pdf_session(pdf_id: str):
     """Restore complete PDF session"""
-    pdf = db.query(PDFHistory).filter_by(pdf_id=pdf_id).first()
+    pdf, qa_rows = await asyncio.gather(
+        fetch_one(select(PDFHistory.pdf_id, PDFHistory.filename, PDFHistory.chunks_count, PDFHistory.processed_at,
+                         PDFHistory.chunks).where(PDFHistory.pdf_id == pdf_id)),
+        fetch_all(select(DocumentQA.query, DocumentQA.answer, DocumentQA.mode, DocumentQA.created_at)
+                  .where(DocumentQA.pdf_id == pdf_id).order_by(DocumentQA.created_at)),
+    )
     if not pdf:
         raise HTTPException(status_code=404, detail="PDF session not found")
 
@@ -466,13 +1214,20 @@ async def restore_pdf_session(pdf_id: str, db: Session = Depends(get_db)):
         "success": True,
         "data": {
             "pdf_info": {
-                "id": pdf.pdf_id,
-                "file_name": pdf.filename,
-                "chunks_count": len(pdf.chunks),
-                "processed_at": pdf.processed_at.isoformat()
+                "id": pdf["pdf_id"],
+                "file_name": pdf["filename"],
+                "chunks_count": pdf["chunks_count"],
+                "processed_at": pdf["processed_at"].isoformat()
             },
-            "qa_history": [],  # implement if you save Q&A
-            "chunks": pdf.chunks
+            "qa_history": [
+                {
+                    "query": qa["query"],
+                    "answer": qa["answer"],
+                    "mode": qa["mode"],
+                    "created_at": qa["created_at"].isoformat()
+                } for qa in qa_rows
+            ],
+            "chunks": pdf["chunks"]
         }
     }
 
@@ -481,18 +1236,43 @@ async def delete_market_history(market_id: int, db: Session = Depends(get_db)):
     row = db.query(MarketAnalysis).filter(MarketAnalysis.id == market_id).first()
     if not row:
         raise HTTPException(status_code=404, detail="Market history not found")
+    market_key, analysis_type = row.market_key, row.analysis_type
     db.delete(row)
     db.commit()
+    analysis_cache.invalidate(market_key, analysis_type)
     return {"success": True, "message": f"Deleted market history id={market_id}"}
 
+def delete_document(pdf_id: str):
+    """
+    Deletes a stored document with its pages and Q&A, then its remote files
+    and their cached chunk answers (blocking; call through run_agent).
+    Returns the deleted remote file ids, or None if there is no such document.
+    """
+    with SessionLocal() as session:
+        row = session.query(PDFHistory).filter(PDFHistory.pdf_id == pdf_id).first()
+        if not row:
+            return None
+        file_ids = [c["file_id"] for c in row.chunks or []]
+        session.delete(row)
+        session.query(PDFPage).filter(PDFPage.pdf_id == pdf_id).delete(synchronize_session=False)
+        session.query(DocumentQA).filter(DocumentQA.pdf_id == pdf_id).delete(synchronize_session=False)
+        session.commit()
+    page_indexes.evict(pdf_id)
+    # Chunks shared with other documents (same bytes) are kept
+    deleted = collect_remote_files(file_ids)
+    if deleted:
+        with SessionLocal() as session:
+            session.query(ChunkAnswer).filter(ChunkAnswer.file_id.in_(deleted)).delete(synchronize_session=False)
+            session.commit()
+    return deleted
+
 @app.delete("/api/history/delete-pdf/{pdf_id}")
-async def delete_pdf_history(pdf_id: str, db: Session = Depends(get_db)):
-    row = db.query(PDFHistory).filter(PDFHistory.pdf_id == pdf_id).first()
-    if not row:
+async def delete_pdf_history(pdf_id: str):
+    deleted = await run_agent(delete_document, pdf_id)
+    if deleted is None:
         raise HTTPException(status_code=404, detail="PDF history not found")
-    db.delete(row)
-    db.commit()
-    return {"success": True, "message": f"Deleted PDF history pdf_id={pdf_id}"}
+    return {"success": True, "message": f"Deleted PDF history pdf_id={pdf_id}",
+            "remote_files_deleted": len(deleted)}
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,176 @@
+# file_registry.py - Content-addressed registry of chunk PDFs uploaded to the Files API
+
+import os
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from openai import NotFoundError
+from backend.llm_scheduler import llm_call, BATCH, BACKGROUND
+
+# A registered file is re-checked against the API once this old
+REMOTE_FILE_VERIFY_HOURS = float(os.getenv("REMOTE_FILE_VERIFY_HOURS", "24"))
+# Unreferenced files used more recently than this are never collected
+REMOTE_FILE_LEASE_SECONDS = float(os.getenv("REMOTE_FILE_LEASE_SECONDS", "600"))
+# Unreferenced files (e.g. from comparisons) are collected after this long unused
+REMOTE_FILE_GC_GRACE_HOURS = float(os.getenv("REMOTE_FILE_GC_GRACE_HOURS", "24"))
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class MemoryFileStore:
+    """
+    Process-local store of sha256 -> remote file entries. The API server swaps
+    in a database-backed store with the same methods.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, sha256: str):
+        with self._lock:
+            entry = self._entries.get(sha256)
+            return dict(entry) if entry else None
+
+    def get_by_file_id(self, file_id: str):
+        with self._lock:
+            for sha256, entry in self._entries.items():
+                if entry["file_id"] == file_id:
+                    return sha256, dict(entry)
+        return None
+
+    def put(self, sha256: str, file_id: str, size: int):
+        now = datetime.utcnow()
+        with self._lock:
+            self._entries[sha256] = {"file_id": file_id, "size": size, "created_at": now,
+                                     "verified_at": now, "last_used_at": now}
+
+    def touch(self, sha256: str, verified: bool = False):
+        now = datetime.utcnow()
+        with self._lock:
+            entry = self._entries.get(sha256)
+            if entry:
+                entry["last_used_at"] = now
+                if verified:
+                    entry["verified_at"] = now
+
+    def last_used(self, file_ids) -> dict:
+        file_ids = set(file_ids)
+        with self._lock:
+            return {e["file_id"]: e["last_used_at"] for e in self._entries.values() if e["file_id"] in file_ids}
+
+    def unused_since(self, cutoff: datetime) -> list:
+        with self._lock:
+            return [e["file_id"] for e in self._entries.values() if e["last_used_at"] < cutoff]
+
+    def delete(self, file_ids):
+        file_ids = set(file_ids)
+        with self._lock:
+            for sha256 in [s for s, e in self._entries.items() if e["file_id"] in file_ids]:
+                del self._entries[sha256]
+
+
+class RemoteFileRegistry:
+    """
+    Maps a chunk's byte hash to the remote file holding those bytes, so the
+    upload and compare paths upload each distinct chunk once. Registered files
+    are re-verified with the API every REMOTE_FILE_VERIFY_HOURS and re-uploaded
+    if they have disappeared.
+    """
+
+    def __init__(self, store=None):
+        self.store = store or MemoryFileStore()
+        # Striped locks so concurrent uploads of the same bytes upload once
+        self._locks = [threading.Lock() for _ in range(64)]
+        self._stats_lock = threading.Lock()
+        self.counters = {"uploaded": 0, "reused": 0, "reuploaded": 0, "verified": 0, "deleted": 0}
+
+    def _count(self, name: str, n: int = 1):
+        with self._stats_lock:
+            self.counters[name] += n
+
+    def _exists_remotely(self, file_id: str) -> bool:
+        try:
+            remote = llm_call(lambda c: c.files.retrieve(file_id), priority=BATCH, agent="files",
+                              label=f"retrieve {file_id}")
+        except NotFoundError:
+            return False
+        self._count("verified")
+        return getattr(remote, "status", None) != "error"
+
+    def _alive(self, sha256: str, entry: dict) -> bool:
+        if entry["verified_at"] >= datetime.utcnow() - timedelta(hours=REMOTE_FILE_VERIFY_HOURS):
+            self.store.touch(sha256)
+            return True
+        if self._exists_remotely(entry["file_id"]):
+            self.store.touch(sha256, verified=True)
+            return True
+        self.store.delete([entry["file_id"]])
+        return False
+
+    def get_or_upload(self, data: bytes, filename: str) -> tuple:
+        """Returns (file_id, sha256, uploaded) for the given chunk bytes."""
+        sha256 = content_hash(data)
+        with self._locks[int(sha256[:8], 16) % len(self._locks)]:
+            entry = self.store.get(sha256)
+            if entry and self._alive(sha256, entry):
+                self._count("reused")
+                return entry["file_id"], sha256, False
+            uploaded = llm_call(
+                lambda c: c.files.create(file=(filename, data, "application/pdf"), purpose="user_data"),
+                priority=BATCH, agent="files", label=f"upload {filename}", hedge=False)
+            self.store.put(sha256, uploaded.id, len(data))
+            self._count("reuploaded" if entry else "uploaded")
+            return uploaded.id, sha256, True
+
+    def is_alive(self, file_id: str) -> bool:
+        found = self.store.get_by_file_id(file_id)
+        if found:
+            return self._alive(*found)
+        # Files uploaded before the registry existed are checked every time
+        return self._exists_remotely(file_id)
+
+    def all_alive(self, file_ids: list) -> bool:
+        return all(self.is_alive(file_id) for file_id in file_ids)
+
+    def forget(self, file_id: str):
+        """Drops a file the API reported missing so it is re-uploaded next time."""
+        self.store.delete([file_id])
+
+    def collect_garbage(self, referenced: set, candidates=()) -> list:
+        """
+        Deletes remote files that no stored document references: the given
+        candidates (e.g. chunks of a just-deleted document) once they have been
+        idle for REMOTE_FILE_LEASE_SECONDS, plus any registered file unused for
+        REMOTE_FILE_GC_GRACE_HOURS. Returns the deleted file ids.
+        """
+        now = datetime.utcnow()
+        lease_cutoff = now - timedelta(seconds=REMOTE_FILE_LEASE_SECONDS)
+        candidates = set(candidates) - referenced
+        last_used = self.store.last_used(candidates)
+        orphans = {f for f in candidates if f not in last_used or last_used[f] < lease_cutoff}
+        orphans |= set(self.store.unused_since(now - timedelta(hours=REMOTE_FILE_GC_GRACE_HOURS))) - referenced
+
+        deleted = []
+        for file_id in orphans:
+            try:
+                llm_call(lambda c: c.files.delete(file_id), priority=BACKGROUND, agent="files",
+                         label=f"delete {file_id}", hedge=False)
+            except NotFoundError:
+                pass
+            except Exception as e:
+                print(f"⚠️ Could not delete remote file {file_id}: {e}")
+                continue
+            deleted.append(file_id)
+        self.store.delete(deleted)
+        self._count("deleted", len(deleted))
+        return deleted
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return dict(self.counters)
+
+
+file_registry = RemoteFileRegistry()
@@ -1,14 +1,11 @@
 # global_metrics_agent.py
 
 import os
-import time
-from dotenv import load_dotenv
-from openai import OpenAI, RateLimitError
+from backend.llm_scheduler import llm_call
+from backend.llm_client import stream_response_text
 
-load_dotenv()
 #client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 #client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-client = OpenAI()
 
 TOOLS = [{"type": "web_search_preview"}]
 
@@ -18,27 +15,28 @@ PROMPT_VERSION = "2"
 
 
 def get_global_overview(market: str, retries: int = 3) -> str:
-    for attempt in range(retries):
-        try:
-            print(f"Fetching global metrics for {market} (attempt {attempt+1})")
-            response = client.responses.create(
-                prompt={
-                        "id": PROMPT_ID,
-                        "version": PROMPT_VERSION
-                        },
-                input=market,      
-                temperature=0.3
-            )
-            final = next((o for o in response.output if getattr(o, "type", "") == "message"), None)
-            return "".join(part.text for part in final.content).strip() if final else "⚠️ No output returned."
-        except RateLimitError:
-            delay = 3 + attempt * 2
-            print(f"⚠️ Rate limit hit. Retrying in {delay}s...")
-            time.sleep(delay)
-        except Exception as e:
-            print(f" Error: {e}")
-            break
-    return "⚠️ Failed to fetch global overview."
+    print(f"Fetching global metrics for {market}")
+    response = llm_call(lambda c: c.responses.create(
+        prompt={
+                "id": PROMPT_ID,
+                "version": PROMPT_VERSION
+                },
+        input=market,      
+        temperature=0.3
+    ), attempts=retries, agent="global_overview", label=f"global overview for {market}")
+    final = next((o for o in response.output if getattr(o, "type", "") == "message"), None)
+    return "".join(part.text for part in final.content).strip() if final else "⚠️ No output returned."
+
+def stream_global_overview(market: str):
+    """Streaming variant of get_global_overview: yields text deltas as the model produces them."""
+    yield from stream_response_text(
+        prompt={
+            "id": PROMPT_ID,
+            "version": PROMPT_VERSION
+        },
+        input=market,
+        temperature=0.3
+    )
 
 def main():
     '''
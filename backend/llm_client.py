@@ -0,0 +1,79 @@
+# llm_client.py - Process-wide OpenAI client registry with a shared HTTP connection pool
+
+import os
+import threading
+import httpx
+from dotenv import load_dotenv
+from openai import OpenAI
+
+load_dotenv()
+
+# Connection pool and timeout settings. LLM_BASE_URL points the client at a
+# different server (e.g. a local stub during tests); falls back to the SDK's
+# own OPENAI_BASE_URL handling when unset.
+LLM_BASE_URL = os.getenv("LLM_BASE_URL") or None
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "256"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "64"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "300"))
+
+_lock = threading.Lock()
+_client = None
+
+
+def _build_client() -> OpenAI:
+    timeout = httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=timeout,
+    )
+    # Retries are handled by backend/llm_scheduler.py, not the SDK
+    return OpenAI(base_url=LLM_BASE_URL, http_client=http_client, timeout=timeout, max_retries=0)
+
+
+def get_client(timeout: float = None) -> OpenAI:
+    """
+    Returns the shared OpenAI client. Every agent module uses this so all calls
+    share one keep-alive connection pool. Passing a timeout returns a view of the
+    same client with a different per-call timeout.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = _build_client()
+    if timeout is not None:
+        return _client.with_options(timeout=timeout)
+    return _client
+
+
+def close_client():
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def stream_response_text(**kwargs):
+    """
+    Calls the Responses API with stream=True and yields output text deltas as
+    they arrive. Takes the same arguments as client.responses.create. The
+    stream holds one scheduler slot until it ends.
+    """
+    from backend.llm_scheduler import scheduler
+    with scheduler.slot():
+        stream = get_client().responses.create(stream=True, **kwargs)
+        try:
+            for event in stream:
+                if event.type == "response.output_text.delta":
+                    yield event.delta
+                elif event.type in ("response.failed", "error"):
+                    raise RuntimeError(getattr(event, "message", None) or "Streaming response failed")
+        finally:
+            stream.close()
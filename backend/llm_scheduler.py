@@ -0,0 +1,425 @@
+# llm_scheduler.py - Process-wide scheduler for OpenAI calls: priorities, a concurrency cap and retries
+
+import os
+import json
+import time
+import heapq
+import random
+import bisect
+import itertools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeout
+from openai import RateLimitError, APIConnectionError, InternalServerError
+from backend.rate_limiter import retry_after_seconds
+from backend.llm_client import get_client
+from backend.cancellation import Cancelled, current_cancel, CANCEL_POLL_SECONDS
+
+INTERACTIVE, BATCH, BACKGROUND = "interactive", "batch", "background"
+PRIORITY_RANK = {INTERACTIVE: 0, BATCH: 1, BACKGROUND: 2}
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+# Fraction of the slots batch (and lower) work may hold, so interactive calls
+# always find free capacity while a large document job is running
+LLM_BATCH_SHARE = float(os.getenv("LLM_BATCH_SHARE", "0.75"))
+LLM_BACKGROUND_SHARE = float(os.getenv("LLM_BACKGROUND_SHARE", "0.25"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+
+# Overall time allowed for one call including retries, per agent (JSON in LLM_DEADLINES)
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "120"))
+LLM_DEADLINES = {"web_insights": 180, "mergers": 180, **json.loads(os.getenv("LLM_DEADLINES", "{}"))}
+# Hedged duplicates allowed, as a fraction of calls; 0 disables hedging
+LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.05"))
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def deadline_for(agent: str) -> float:
+    return float(LLM_DEADLINES.get(agent, LLM_DEADLINE_SECONDS))
+
+# Priority of calls made from the current request; run_agent copies it into worker threads
+current_priority = ContextVar("llm_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(name: str):
+    """Runs the enclosed calls (in this context) at the given priority class."""
+    token = current_priority.set(name)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+def backoff_delay(attempt: int, headers=None) -> float:
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+    jittered = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+    return max(retry_after_seconds(headers), jittered)
+
+
+class LatencyHistogram:
+    """
+    Log-bucketed latency histogram (50 ms to ~20 min, 25% steps). Counts are
+    halved every 2000 samples so quantiles follow recent behaviour.
+    """
+
+    BOUNDS = [0.05 * 1.25 ** i for i in range(46)]
+    DECAY_EVERY = 2000
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0
+        self._since_decay = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+            self.total += 1
+            self._since_decay += 1
+            if self._since_decay >= self.DECAY_EVERY:
+                self.counts = [c // 2 for c in self.counts]
+                self.total = sum(self.counts)
+                self._since_decay = 0
+
+    def quantile(self, q: float, min_samples: int = 1):
+        """Upper bound of the bucket holding quantile q, or None with too few samples."""
+        with self._lock:
+            if self.total < max(1, min_samples):
+                return None
+            rank, seen = q * self.total, 0
+            for i, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    return self.BOUNDS[min(i, len(self.BOUNDS) - 1)]
+            return self.BOUNDS[-1]
+
+    def snapshot(self) -> dict:
+        return {"count": self.total, **{f"p{int(q * 100)}": self.quantile(q) for q in (0.5, 0.95, 0.99)}}
+
+
+class LLMScheduler:
+    """
+    Admits calls from worker threads in priority order under one process-wide
+    concurrency cap. Batch and background classes may only hold their share
+    of the slots. Retryable failures release the slot while backing off.
+
+    Each call runs under its agent's deadline. Once an agent has enough
+    latency samples, a call still running at the agent's p95 is hedged: a
+    duplicate is sent (if a slot is free and the hedge budget allows) and the
+    first response wins.
+
+    Calls made under a cancel token (see run_agent) give up while queued,
+    backing off or waiting on a response once it is cancelled. A request
+    already sent runs on in the background and keeps its slot until it
+    returns, so the cap always bounds the requests actually in flight.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.limits = {
+            INTERACTIVE: max_concurrency,
+            BATCH: max(1, int(max_concurrency * LLM_BATCH_SHARE)),
+            BACKGROUND: max(1, int(max_concurrency * LLM_BACKGROUND_SHARE)),
+        }
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (rank, seq)
+        self._seq = itertools.count()
+        self._running = {name: 0 for name in PRIORITY_RANK}
+        self._queued = {name: 0 for name in PRIORITY_RANK}
+        self._counters = {
+            name: {"submitted": 0, "completed": 0, "failed": 0, "retries": 0, "cancelled": 0,
+                   "admitted": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+            for name in PRIORITY_RANK
+        }
+        self._latency = {}  # agent -> LatencyHistogram
+        # Every request on this pool holds a slot, so it never has more than
+        # max_concurrency tasks and a submitted request starts at once
+        self._hedge_pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm-hedge")
+        self.hedging = {"calls": 0, "hedged": 0, "hedge_won": 0, "deadline_exceeded": 0}
+
+    def histogram(self, agent: str) -> LatencyHistogram:
+        with self._cond:
+            if agent not in self._latency:
+                self._latency[agent] = LatencyHistogram()
+            return self._latency[agent]
+
+    def _can_run(self, name: str) -> bool:
+        if sum(self._running.values()) >= self.max_concurrency:
+            return False
+        # A class's limit covers it and every class below it
+        rank = PRIORITY_RANK[name]
+        held = sum(n for other, n in self._running.items() if PRIORITY_RANK[other] >= rank)
+        return held < self.limits[name]
+
+    def _acquire(self, name: str, token=None):
+        t0 = time.perf_counter()
+        with self._cond:
+            entry = (PRIORITY_RANK[name], next(self._seq))
+            heapq.heappush(self._waiting, entry)
+            self._queued[name] += 1
+            while not (self._waiting[0] == entry and self._can_run(name)):
+                if token is not None and token.cancelled():
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._queued[name] -= 1
+                    self._cond.notify_all()
+                    raise Cancelled("LLM call cancelled while queued")
+                self._cond.wait(CANCEL_POLL_SECONDS if token is not None else None)
+            heapq.heappop(self._waiting)
+            self._queued[name] -= 1
+            self._running[name] += 1
+            waited = time.perf_counter() - t0
+            counters = self._counters[name]
+            counters["admitted"] += 1
+            counters["wait_seconds"] += waited
+            counters["max_wait_seconds"] = max(counters["max_wait_seconds"], waited)
+            self._cond.notify_all()
+
+    def _try_acquire(self, name: str) -> bool:
+        """Takes a slot only if one is free right now and nobody is queued."""
+        with self._cond:
+            if self._waiting or not self._can_run(name):
+                return False
+            self._running[name] += 1
+            return True
+
+    def _release(self, name: str):
+        with self._cond:
+            self._running[name] -= 1
+            self._cond.notify_all()
+
+    def _count(self, name: str, key: str):
+        with self._cond:
+            self._counters[name][key] += 1
+
+    @contextmanager
+    def slot(self, name: str = None):
+        """Holds one slot for the enclosed block, e.g. for the length of a stream."""
+        name = name or current_priority.get()
+        self._count(name, "submitted")
+        try:
+            self._acquire(name, current_cancel.get())
+        except Cancelled:
+            self._count(name, "cancelled")
+            raise
+        try:
+            yield
+            self._count(name, "completed")
+        except Exception:
+            self._count(name, "failed")
+            raise
+        finally:
+            self._release(name)
+
+    def _hedge_allowed(self) -> bool:
+        with self._cond:
+            return self.hedging["hedged"] < LLM_HEDGE_BUDGET * self.hedging["calls"]
+
+    def _result(self, future, token, timeout: float = None):
+        """future.result(timeout), giving up early if token is cancelled."""
+        if token is None:
+            return future.result(timeout=timeout)
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            step = CANCEL_POLL_SECONDS if end is None else max(0, min(CANCEL_POLL_SECONDS, end - time.monotonic()))
+            try:
+                return future.result(timeout=step)
+            except FutureTimeout:
+                if token.cancelled():
+                    raise Cancelled("LLM call cancelled")
+                if end is not None and time.monotonic() >= end:
+                    raise
+
+    def _submit(self, func, name: str, timeout: float):
+        """
+        Runs func(client) on the side pool under a slot the caller holds. The
+        slot is released when the request returns, not when the caller stops
+        waiting for it (after a cancellation, or as the losing hedge).
+        """
+        try:
+            future = self._hedge_pool.submit(func, get_client(timeout=timeout))
+        except BaseException:
+            self._release(name)
+            raise
+        future.add_done_callback(lambda _: self._release(name))
+        return future
+
+    def _wait(self, future, token, agent: str, deadline_at: float):
+        """The future's result, within the deadline and unless token is cancelled."""
+        try:
+            return self._result(future, token, timeout=max(0, deadline_at - time.monotonic()))
+        except FutureTimeout:
+            if future.done():
+                raise
+            raise DeadlineExceeded(f"{agent} deadline exceeded") from None
+
+    def _run_once(self, func, name: str, agent: str, deadline_at: float, hedge: bool, token=None):
+        """
+        One attempt: func(client) with the remaining deadline as its timeout,
+        hedged if slow. Takes over the slot acquired for it; see _submit.
+        """
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            self._release(name)
+            raise DeadlineExceeded(f"{agent} deadline exceeded")
+        threshold = self.histogram(agent).quantile(LLM_HEDGE_QUANTILE, LLM_HEDGE_MIN_SAMPLES) if hedge else None
+        if threshold is None or LLM_HEDGE_BUDGET <= 0 or threshold >= remaining:
+            if token is None:
+                try:
+                    return func(get_client(timeout=remaining))
+                finally:
+                    self._release(name)
+            # Run it on the side so a cancellation doesn't have to wait for the response
+            return self._wait(self._submit(func, name, remaining), token, agent, deadline_at)
+
+        primary = self._submit(func, name, remaining)
+        try:
+            return self._result(primary, token, timeout=threshold)
+        except FutureTimeout:
+            if primary.done():
+                raise
+        if not self._hedge_allowed() or not self._try_acquire(name):
+            return self._wait(primary, token, agent, deadline_at)
+        with self._cond:
+            self.hedging["hedged"] += 1
+        backup = self._submit(func, name, max(0.001, deadline_at - time.monotonic()))
+        pending = {primary, backup}
+        # The losing request keeps running (and holding its slot) until it returns or times out
+        while True:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"{agent} deadline exceeded")
+            done, pending = wait(pending, timeout=min(CANCEL_POLL_SECONDS, remaining), return_when=FIRST_COMPLETED)
+            if not done:
+                if token is not None and token.cancelled():
+                    raise Cancelled("LLM call cancelled")
+                continue
+            winner = next((f for f in done if f.exception() is None), None)
+            if winner is None and pending:
+                continue  # first finisher failed; wait for the other
+            winner = winner or next(iter(done))
+            if winner is backup and winner.exception() is None:
+                with self._cond:
+                    self.hedging["hedge_won"] += 1
+            return winner.result()
+
+    def call(self, func, priority: str = None, attempts: int = LLM_MAX_ATTEMPTS, label: str = "", limiter=None,
+             agent: str = "default", deadline: float = None, hedge: bool = True):
+        """
+        Runs func(client) (one API request) in a slot, retrying rate limits,
+        connection errors and 5xx responses with jittered exponential backoff.
+        client is the shared client with its timeout set to what is left of the
+        agent's deadline. If limiter is given (an AdaptiveRateLimiter), each
+        attempt is paced by it and it is fed the response headers. Pass
+        hedge=False for requests that are not safe to duplicate (e.g. uploads).
+        Raises Cancelled if the calling worker's cancel token is set.
+        """
+        name = priority or current_priority.get()
+        token = current_cancel.get()
+        deadline_at = time.monotonic() + (deadline or deadline_for(agent))
+        self._count(name, "submitted")
+        with self._cond:
+            self.hedging["calls"] += 1
+        for attempt in range(attempts):
+            if token is not None and token.cancelled():
+                self._count(name, "cancelled")
+                raise Cancelled(f"{label or 'LLM call'} cancelled")
+            if limiter:
+                limiter.acquire()
+            try:
+                self._acquire(name, token)
+            except Cancelled:
+                self._count(name, "cancelled")
+                raise
+            t0 = time.monotonic()
+            try:
+                # _run_once releases the slot once its request has returned
+                result = self._run_once(func, name, agent, deadline_at, hedge, token)
+            except RETRYABLE_ERRORS as e:
+                headers = getattr(getattr(e, "response", None), "headers", None)
+                if limiter and isinstance(e, RateLimitError):
+                    limiter.on_rate_limited(headers)
+                delay = backoff_delay(attempt, headers)
+                if attempt + 1 >= attempts or time.monotonic() + delay >= deadline_at:
+                    self._count(name, "failed")
+                    if time.monotonic() + delay >= deadline_at:
+                        with self._cond:
+                            self.hedging["deadline_exceeded"] += 1
+                    raise
+                print(f"⚠️ {type(e).__name__} on {label or 'LLM call'}, retrying in {delay:.1f}s")
+                self._count(name, "retries")
+            except Cancelled:
+                self._count(name, "cancelled")
+                raise
+            except DeadlineExceeded:
+                self._count(name, "failed")
+                with self._cond:
+                    self.hedging["deadline_exceeded"] += 1
+                raise
+            except Exception:
+                self._count(name, "failed")
+                raise
+            else:
+                self.histogram(agent).record(time.monotonic() - t0)
+                if limiter:
+                    limiter.on_success(getattr(result, "headers", None))
+                self._count(name, "completed")
+                return result
+            if token is not None:
+                token.wait(delay)
+            else:
+                time.sleep(delay)
+
+    def stats(self) -> dict:
+        with self._cond:
+            classes = {}
+            for name, counters in self._counters.items():
+                admitted = counters["admitted"]
+                classes[name] = {
+                    "queued": self._queued[name],
+                    "running": self._running[name],
+                    "limit": self.limits[name],
+                    "submitted": counters["submitted"],
+                    "completed": counters["completed"],
+                    "failed": counters["failed"],
+                    "retries": counters["retries"],
+                    "cancelled": counters["cancelled"],
+                    "avg_wait_seconds": round(counters["wait_seconds"] / admitted, 4) if admitted else 0.0,
+                    "max_wait_seconds": round(counters["max_wait_seconds"], 4),
+                }
+            agents = dict(self._latency)
+            hedging = dict(self.hedging)
+        latency = {}
+        for agent, histogram in agents.items():
+            latency[agent] = histogram.snapshot()
+            latency[agent]["deadline_seconds"] = deadline_for(agent)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": sum(classes[name]["running"] for name in classes),
+            "queued": sum(classes[name]["queued"] for name in classes),
+            "classes": classes,
+            "hedging": {**hedging, "budget": LLM_HEDGE_BUDGET, "quantile": LLM_HEDGE_QUANTILE},
+            "latency": latency,
+        }
+
+
+scheduler = LLMScheduler()
+
+
+def shutdown_scheduler():
+    scheduler._hedge_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def llm_call(func, **kwargs):
+    """Submits one API request to the shared scheduler; see LLMScheduler.call."""
+    return scheduler.call(func, **kwargs)
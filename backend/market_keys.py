@@ -0,0 +1,174 @@
+# market_keys.py - Canonical market keys and fuzzy matching against known markets
+
+import os
+import re
+import json
+import threading
+import unicodedata
+
+MARKET_MATCH_THRESHOLD = float(os.getenv("MARKET_MATCH_THRESHOLD", "0.8"))
+
+# Words that don't change which market is meant
+FILLER_WORDS = {"the", "market", "markets", "industry", "industries", "sector", "global", "worldwide"}
+
+# Words that tell otherwise-identical markets apart; a fuzzy match may never
+# swap one of these (or a number) for another, only fix typos elsewhere
+QUALIFIER_WORDS = {
+    "north", "south", "east", "west", "northern", "southern", "eastern", "western", "central",
+    "american", "european", "asian", "african", "latin", "middle", "pacific", "atlantic",
+    "level", "class", "type", "tier", "grade", "stage", "phase", "generation", "gen", "series",
+    "small", "medium", "large", "mini", "micro", "nano", "mega", "light", "heavy",
+    "residential", "commercial", "industrial", "consumer", "enterprise", "public", "private",
+    "domestic", "international", "online", "offline", "new", "used", "male", "female",
+}
+
+# Common abbreviations, applied after normalization. Extend with a JSON file of
+# {"alias": "canonical name"} pairs pointed to by MARKET_ALIASES_FILE.
+MARKET_ALIASES = {
+    "ev": "electric vehicle",
+    "evs": "electric vehicle",
+    "bev": "battery electric vehicle",
+    "ai": "artificial intelligence",
+    "ml": "machine learning",
+    "iot": "internet of things",
+    "ar": "augmented reality",
+    "vr": "virtual reality",
+    "saas": "software as a service",
+    "3d printing": "additive manufacturing",
+}
+
+_aliases_file = os.getenv("MARKET_ALIASES_FILE")
+if _aliases_file and os.path.exists(_aliases_file):
+    with open(_aliases_file) as f:
+        MARKET_ALIASES.update({k.lower(): v.lower() for k, v in json.load(f).items()})
+
+
+def _singular(word: str) -> str:
+    if len(word) <= 3 or word.endswith(("ss", "us", "is")):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("ches", "shes", "xes", "sses")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def _clean(name: str) -> str:
+    text = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    text = text.lower().replace("&", " and ")
+    text = re.sub(r"[^a-z0-9]+", " ", text)
+    words = [_singular(w) for w in text.split() if w not in FILLER_WORDS]
+    return " ".join(words)
+
+
+def canonical_market(name: str) -> str:
+    """
+    Canonical cache key for a market name: case, accents, punctuation and
+    plurals folded, filler words dropped and aliases expanded, so
+    "Electric Vehicles", "electric vehicles " and "EV market" share a key.
+    """
+    key = _clean(name or "")
+    if key in MARKET_ALIASES:
+        return _clean(MARKET_ALIASES[key])
+    words = [MARKET_ALIASES.get(w, w) for w in key.split()]
+    return _clean(" ".join(words)) or (name or "").strip().lower()
+
+
+def _trigrams(key: str) -> set:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _edit_distance(a: str, b: str) -> int:
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+def _is_typo(a: str, b: str) -> bool:
+    """True when b reads as a misspelling of a (same first letter, one or two edits)."""
+    if a[0] != b[0] or any(c.isdigit() for c in a + b) or a in QUALIFIER_WORDS or b in QUALIFIER_WORDS:
+        return False
+    return _edit_distance(a, b) <= (2 if min(len(a), len(b)) >= 6 else 1)
+
+
+def tokens_agree(a: str, b: str) -> bool:
+    """
+    Whether two canonical keys name the same market up to typos: same number
+    of words, and every word that differs is a near-spelling of its partner,
+    never a number or a qualifier like "north"/"south" or "level".
+    """
+    wa, wb = a.split(), b.split()
+    return len(wa) == len(wb) and all(x == y or _is_typo(x, y) for x, y in zip(wa, wb))
+
+
+class MarketIndex:
+    """In-memory trigram index over known canonical market keys."""
+
+    def __init__(self, threshold: float = MARKET_MATCH_THRESHOLD):
+        self.threshold = threshold
+        self._grams = {}
+        self._postings = {}
+        self._lock = threading.Lock()
+
+    def add(self, key: str):
+        with self._lock:
+            if key in self._grams:
+                return
+            grams = _trigrams(key)
+            self._grams[key] = grams
+            for g in grams:
+                self._postings.setdefault(g, set()).add(key)
+
+    def discard(self, key: str):
+        with self._lock:
+            grams = self._grams.pop(key, None)
+            for g in grams or ():
+                self._postings.get(g, set()).discard(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._grams
+
+    def __len__(self) -> int:
+        return len(self._grams)
+
+    def similar(self, key: str) -> list:
+        """[(known_key, similarity), ...] for known markets sharing a trigram, most similar first."""
+        grams = _trigrams(key)
+        with self._lock:
+            if key in self._grams:
+                return [(key, 1.0)]
+            shared = {}
+            for g in grams:
+                for candidate in self._postings.get(g, ()):
+                    shared[candidate] = shared.get(candidate, 0) + 1
+            scored = [(candidate, overlap / (len(grams) + len(self._grams[candidate]) - overlap))
+                      for candidate, overlap in shared.items()]
+        return sorted(scored, key=lambda c: c[1], reverse=True)
+
+    def best_match(self, key: str):
+        """Returns (known_key, similarity) for the closest known market, or (None, 0.0)."""
+        scored = self.similar(key)
+        return scored[0] if scored else (None, 0.0)
+
+    def resolve(self, name: str):
+        """
+        Maps a market name to the key an existing analysis may be stored
+        under. Returns (key, matched) where matched is True when a known
+        market above the similarity threshold whose words agree up to typos
+        (see tokens_agree) was used. Only for reads: new analyses are always
+        stored under canonical_market(name).
+        """
+        key = canonical_market(name)
+        for match, score in self.similar(key):
+            if score < self.threshold or match == key:
+                break
+            if tokens_agree(key, match):
+                return match, True
+        return key, False
@@ -1,27 +1,17 @@
 import os
-import time
-from openai import OpenAI, RateLimitError
-from dotenv import load_dotenv
+from backend.llm_scheduler import llm_call
+from backend.llm_client import stream_response_text
 
 
-# Load your API key
-load_dotenv()
-client = OpenAI()
-
 # Stored prompt reference
 PROMPT_ID = "pmpt_6887e2f23c9c81959d041e23c50f22d8024bea49ae171cac"
 PROMPT_VERSION = "1"
 TOOLS = [{"type": "web_search_preview"}]
 
 
-def get_mergers_table(market: str, timeframe: str, retries: int = 3) -> str:
-    """
-    Retrieves an M&A deals table for the given market and timeframe using a saved prompt template.
-    Returns the result as a Markdown table string.
-    """
-    prompt_ref = {"id": PROMPT_ID, "version": PROMPT_VERSION}
+def _deals_message(market: str, timeframe: str) -> dict:
     # Build a single user message with both inputs as content items
-    user_message = {
+    return {
         "role": "user",
         "content": [
             {"type": "input_text", "text": market},
@@ -29,32 +19,44 @@ def get_mergers_table(market: str, timeframe: str, retries: int = 3) -> str:
         ]
     }
 
-    for attempt in range(1, retries + 1):
-        try:
-            print(f"🔍 Fetching M&A data for '{market}' in '{timeframe}' (attempt {attempt})")
-            response = client.responses.create(
-                prompt=prompt_ref,
-                input=[user_message],
-                tools=TOOLS,
-                temperature=0.3
-            )
-            # Extract the assistant message
-            message = next((o for o in response.output if getattr(o, "type", "") == "message"), None)
-            if message:
-                return "".join(part.text for part in message.content).strip()
-            return "⚠️ No output returned."
 
-        except RateLimitError:
-            delay = 2 * attempt
-            print(f"⚠️ Rate limit hit, retrying in {delay}s...")
-            time.sleep(delay)
-        except Exception as e:
-            print(f"❌ Error on attempt {attempt}: {e}")
-            break
+def get_mergers_table(market: str, timeframe: str, retries: int = 3) -> str:
+    """
+    Retrieves an M&A deals table for the given market and timeframe using a saved prompt template.
+    Returns the result as a Markdown table string.
+    """
+    prompt_ref = {"id": PROMPT_ID, "version": PROMPT_VERSION}
+    user_message = _deals_message(market, timeframe)
+
+    try:
+        print(f"🔍 Fetching M&A data for '{market}' in '{timeframe}'")
+        response = llm_call(lambda c: c.responses.create(
+            prompt=prompt_ref,
+            input=[user_message],
+            tools=TOOLS,
+            temperature=0.3
+        ), attempts=retries, agent="mergers", label=f"M&A deals for {market}")
+        # Extract the assistant message
+        message = next((o for o in response.output if getattr(o, "type", "") == "message"), None)
+        if message:
+            return "".join(part.text for part in message.content).strip()
+        return "⚠️ No output returned."
 
+    except Exception as e:
+        print(f"❌ Error: {e}")
     return "⚠️ Failed to retrieve M&A data after retries."
 
 
+def stream_mergers_table(market: str, timeframe: str):
+    """Streaming variant of get_mergers_table: yields Markdown deltas as they arrive."""
+    yield from stream_response_text(
+        prompt={"id": PROMPT_ID, "version": PROMPT_VERSION},
+        input=[_deals_message(market, timeframe)],
+        tools=TOOLS,
+        temperature=0.3
+    )
+
+
 def main():
     st.title("Mergers & Acquisitions Explorer")
     market = st.text_input("Market (e.g. Electric Vehicles)", value="Electric Vehicles")
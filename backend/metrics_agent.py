@@ -1,12 +1,9 @@
 # metrics_agent.py
 
 import os
-from openai import OpenAI
-from dotenv import load_dotenv
+from backend.llm_scheduler import llm_call
 
-load_dotenv()
 
-client = OpenAI()
 PROMPT_ID = "pmpt_6887def9d9a08195bb898ddc5bc4a12106162e31af023a7b"
 PROMPT_VERSION = "1"
 
@@ -15,14 +12,14 @@ TOOLS = [{"type": "web_search_preview"}]
 def get_detailed_metrics(submarket: str) -> str:
     user_query = f"Get the market size, CAGR, and forecast period for '{submarket}' market from 2018 to 2023 ."
 
-    response = client.responses.create(
+    response = llm_call(lambda c: c.responses.create(
         prompt={
             "id": PROMPT_ID,
             "version": PROMPT_VERSION
         },
         input=submarket,      # <-- just a string, not {"submarket": submarket}
         temperature=0.3
-    )
+    ), agent="detailed_metrics", label=f"detailed metrics for {submarket}")
 
 
     for item in response.output:
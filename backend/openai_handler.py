@@ -1,14 +1,11 @@
 # openai_handler.py
 
 import os
-import time
-from dotenv import load_dotenv
-from openai import OpenAI, RateLimitError
+from backend.llm_scheduler import llm_call
+from backend.llm_client import stream_response_text
 
-load_dotenv()
 #client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 #client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-client = OpenAI()
 TOOLS = [
     {"type": "web_search_preview"}
 ]
@@ -18,27 +15,28 @@ PROMPT_VERSION = "1"
 
 
 def get_vertical_submarkets(market_query: str, retries: int = 3) -> str:
-    for attempt in range(retries):
-        try:
-            print(f"Fetching verticals for {market_query} [attempt {attempt+1}]")
-            response = client.responses.create(
-                    prompt={
-                        "id": PROMPT_ID,
-                        "version": PROMPT_VERSION
-                    },
-                    input=market_query,      # <-- just a string, not {"submarket": submarket}
-                    temperature = 0.3
-            )
-            final = next((o for o in response.output if getattr(o, "type", "") == "message"), None)
-            return "".join(part.text for part in final.content).strip() if final else "(no output)"
-        except RateLimitError:
-            delay = 3 + attempt * 2
-            print(f"⚠️ Rate limit. Retrying in {delay}s...")
-            time.sleep(delay)
-        except Exception as e:
-            print(f" Error fetching vertical submarkets: {e}")
-            break
-    return "⚠️ Failed to retrieve vertical sub-markets."
+    print(f"Fetching verticals for {market_query}")
+    response = llm_call(lambda c: c.responses.create(
+            prompt={
+                "id": PROMPT_ID,
+                "version": PROMPT_VERSION
+            },
+            input=market_query,      # <-- just a string, not {"submarket": submarket}
+            temperature = 0.3
+    ), attempts=retries, agent="vertical_submarkets", label=f"vertical submarkets for {market_query}")
+    final = next((o for o in response.output if getattr(o, "type", "") == "message"), None)
+    return "".join(part.text for part in final.content).strip() if final else "(no output)"
+
+def stream_vertical_submarkets(market_query: str):
+    """Streaming variant of get_vertical_submarkets: yields text deltas as the model produces them."""
+    yield from stream_response_text(
+        prompt={
+            "id": PROMPT_ID,
+            "version": PROMPT_VERSION
+        },
+        input=market_query,
+        temperature=0.3
+    )
 
 def main():
     st.title("Vertical Segments Explorer")
@@ -0,0 +1,101 @@
+# page_index.py - BM25 index over the extracted page text of uploaded PDFs
+
+import os
+import re
+import math
+import threading
+from collections import Counter, OrderedDict
+
+PAGE_INDEX_TOP_K = int(os.getenv("PAGE_INDEX_TOP_K", "8"))
+PAGE_INDEX_CACHE_SIZE = int(os.getenv("PAGE_INDEX_CACHE_SIZE", "64"))
+
+# Pages with less extractable text than this are treated as scanned images
+MIN_INDEXED_CHARS = 200
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:[.,][0-9]+)*")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "in", "is", "it",
+    "its", "of", "on", "or", "that", "the", "to", "was", "were", "what", "which", "with",
+    "how", "does", "do", "this", "these", "those", "there", "their", "they", "about",
+}
+
+
+def tokenize(text: str) -> list:
+    return [t for t in _TOKEN.findall(text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+class BM25PageIndex:
+    """Okapi BM25 over the pages of one document. Pages are 1-based."""
+
+    def __init__(self, page_texts: list, k1: float = 1.5, b: float = 0.75):
+        self.k1, self.b = k1, b
+        self.page_count = len(page_texts)
+        self.term_freqs = [Counter(tokenize(t)) for t in page_texts]
+        self.lengths = [sum(tf.values()) for tf in self.term_freqs]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0
+        self.postings = {}
+        for page, tf in enumerate(self.term_freqs):
+            for term in tf:
+                self.postings.setdefault(term, []).append(page)
+        self.text_chars = sum(len(t.strip()) for t in page_texts)
+
+    @property
+    def searchable(self) -> bool:
+        """False for documents (e.g. scans) with too little extractable text."""
+        return self.page_count > 0 and self.text_chars >= MIN_INDEXED_CHARS
+
+    def search(self, query: str, k: int = PAGE_INDEX_TOP_K) -> list:
+        """Returns up to k (page_number, score) pairs, best first."""
+        scores = {}
+        for term in set(tokenize(query)):
+            pages = self.postings.get(term)
+            if not pages:
+                continue
+            idf = math.log(1 + (self.page_count - len(pages) + 0.5) / (len(pages) + 0.5))
+            for page in pages:
+                tf = self.term_freqs[page][term]
+                norm = tf + self.k1 * (1 - self.b + self.b * self.lengths[page] / (self.avg_length or 1))
+                scores[page] = scores.get(page, 0.0) + idf * tf * (self.k1 + 1) / norm
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(page + 1, score) for page, score in best]
+
+
+def page_ranges(pages: list) -> list:
+    """Collapses page numbers into sorted (start, end) runs: [3, 1, 2, 7] -> [(1, 3), (7, 7)]."""
+    ranges = []
+    for page in sorted(set(pages)):
+        if ranges and page == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], page)
+        else:
+            ranges.append((page, page))
+    return ranges
+
+
+class PageIndexRegistry:
+    """LRU of built per-document indexes keyed by pdf_id, loaded on demand."""
+
+    def __init__(self, loader, maxsize: int = PAGE_INDEX_CACHE_SIZE):
+        self._loader = loader  # pdf_id -> list of page texts (or None)
+        self.maxsize = maxsize
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, pdf_id: str):
+        with self._lock:
+            index = self._indexes.get(pdf_id)
+            if index is not None:
+                self._indexes.move_to_end(pdf_id)
+                return index
+        texts = self._loader(pdf_id)
+        if texts is None:
+            return None
+        index = BM25PageIndex(texts)
+        with self._lock:
+            self._indexes[pdf_id] = index
+            while len(self._indexes) > self.maxsize:
+                self._indexes.popitem(last=False)
+        return index
+
+    def evict(self, pdf_id: str):
+        with self._lock:
+            self._indexes.pop(pdf_id, None)
@@ -0,0 +1,46 @@
+# pagination.py - Opaque keyset cursors for newest-first history listings
+
+import json
+import base64
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+HISTORY_PAGE_MAX = 100
+
+
+def encode_cursor(ts: datetime, row_id: int) -> str:
+    """Opaque cursor for the position after the row (ts, row_id)."""
+    raw = json.dumps([ts.isoformat(), row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """(timestamp, id) from encode_cursor; raises ValueError for anything else."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, row_id = json.loads(raw)
+        return datetime.fromisoformat(ts), int(row_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+
+
+def keyset_after(ts_column, id_column, cursor: str):
+    """
+    Filter for rows after the cursor in (ts desc, id desc) order. The leading
+    ts <= bound lets the database seek straight to the page on a (ts, id)
+    index, so page N costs the same as page 1 whatever the table size (plus
+    a scan of rows sharing the cursor's timestamp, normally none).
+    """
+    ts, row_id = decode_cursor(cursor)
+    return and_(ts_column <= ts, or_(ts_column < ts, id_column < row_id))
+
+
+def page_of(rows: list, limit: int, ts_field: str) -> tuple:
+    """
+    Splits rows fetched with limit + 1 into (page, next_cursor); next_cursor
+    is None on the last page.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    return page, encode_cursor(page[-1][ts_field], page[-1]["id"])
@@ -1,30 +1,251 @@
 # pdf_chunks_util.py
 import fitz  # PyMuPDF
 import tempfile
-from openai import OpenAI
+import hashlib
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
-#client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-#client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-client = OpenAI()
-CHUNK_SIZE = 50  # Pages per chunk
-
-def split_pdf_to_chunks(file, chunk_size=CHUNK_SIZE):
-    doc = fitz.open(stream=file.read(), filetype="pdf")
-    total_pages = len(doc)
-    chunks = []
-
-    for start in range(0, total_pages, chunk_size):
-        end = min(start + chunk_size, total_pages)
-        chunk_doc = fitz.open()
-        chunk_doc.insert_pdf(doc, from_page=start, to_page=end - 1)
-
-        temp_path = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf").name
-        chunk_doc.save(temp_path)
-        chunk_doc.close()
-
-        chunks.append((start + 1, end, temp_path))
-    doc.close()
-    return chunks
+import time
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from backend.chunk_planner import CHUNK_TOKEN_BUDGET, estimate_page_tokens, plan_chunks, plan_with_reuse, describe_plan
+
+# Worker processes for splitting files on disk; 0 splits inline in the calling thread
+SPLIT_WORKERS = int(os.getenv("SPLIT_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+def open_pdf(source):
+    """Opens a PDF from a file path (read directly by PyMuPDF) or a readable stream."""
+    if isinstance(source, (str, os.PathLike)):
+        return fitz.open(source)
+    return fitz.open(stream=source.read(), filetype="pdf")
+
+
+TEXT_BLOCK_PAGES = 50  # Pages per text-extraction task in the pool
+# Pages with less normalized text than this are fingerprinted by content stream and images
+FINGERPRINT_MIN_CHARS = 20
+
+
+def page_fingerprint(doc, page, text: str) -> str:
+    """
+    Identifies a page's content independently of the file it is in: a hash of
+    its normalized text, or for scanned/graphic pages, of its content stream
+    and embedded images.
+    """
+    normalized = " ".join(text.lower().split())
+    if len(normalized) >= FINGERPRINT_MIN_CHARS:
+        return hashlib.sha1(b"t:" + normalized.encode("utf-8")).hexdigest()
+    hasher = hashlib.sha1(b"c:")
+    hasher.update(page.read_contents())
+    for image in page.get_images(full=True):
+        hasher.update(doc.xref_stream_raw(image[0]) or b"")
+    return hasher.hexdigest()
+
+
+def _page_entries(doc, start: int, end: int) -> list:
+    entries = []
+    for i in range(start, end):
+        text = doc[i].get_text()
+        entries.append((text, page_fingerprint(doc, doc[i], text)))
+    return entries
+
+
+def _build_chunk(doc, start: int, end: int) -> tuple:
+    """Builds the sub-PDF for 0-based pages [start, end); returns (bytes, seconds)."""
+    t0 = time.perf_counter()
+    chunk_doc = fitz.open()
+    chunk_doc.insert_pdf(doc, from_page=start, to_page=end - 1)
+    data = chunk_doc.tobytes(garbage=3, deflate=True, no_new_id=True)
+    chunk_doc.close()
+    return data, time.perf_counter() - t0
+
+
+def _split_range(path: str, start: int, end: int) -> tuple:
+    """Process-pool task: opens the spooled file and builds one chunk."""
+    doc = fitz.open(path)
+    try:
+        return _build_chunk(doc, start, end)
+    finally:
+        doc.close()
+
+
+def _extract_pages(path: str, start: int, end: int) -> list:
+    """Process-pool task: (text, fingerprint) of 0-based pages [start, end)."""
+    doc = fitz.open(path)
+    try:
+        return _page_entries(doc, start, end)
+    finally:
+        doc.close()
+
+
+_split_pool = None
+_split_pool_lock = threading.Lock()
+_split_metrics = {"chunks": 0, "pages": 0, "busy_seconds": 0.0}
+_split_metrics_lock = threading.Lock()
+
+
+def get_split_pool() -> ProcessPoolExecutor:
+    global _split_pool
+    with _split_pool_lock:
+        if _split_pool is None:
+            # spawn, not fork: the API process is multi-threaded
+            _split_pool = ProcessPoolExecutor(max_workers=SPLIT_WORKERS,
+                                              mp_context=multiprocessing.get_context("spawn"))
+        return _split_pool
+
+
+def shutdown_split_pool():
+    global _split_pool
+    with _split_pool_lock:
+        if _split_pool is not None:
+            _split_pool.shutdown(wait=False, cancel_futures=True)
+            _split_pool = None
+
+
+def split_stats() -> dict:
+    with _split_metrics_lock:
+        busy = _split_metrics["busy_seconds"]
+        return {
+            "workers": SPLIT_WORKERS,
+            "chunks": _split_metrics["chunks"],
+            "pages": _split_metrics["pages"],
+            "busy_seconds": round(busy, 3),
+            "pages_per_busy_second": round(_split_metrics["pages"] / busy, 1) if busy else None,
+        }
+
+
+def _record(start: int, end: int, data: bytes, seconds: float, timings: list):
+    with _split_metrics_lock:
+        _split_metrics["chunks"] += 1
+        _split_metrics["pages"] += end - start
+        _split_metrics["busy_seconds"] += seconds
+    if timings is not None:
+        timings.append({"start": start + 1, "end": end, "bytes": len(data), "split_seconds": round(seconds, 3)})
+
+
+def _extract_in_pool(path) -> list:
+    with fitz.open(path) as doc:
+        total_pages = len(doc)
+    blocks = [(s, min(s + TEXT_BLOCK_PAGES, total_pages)) for s in range(0, total_pages, TEXT_BLOCK_PAGES)]
+    futures = [get_split_pool().submit(_extract_pages, os.fspath(path), s, e) for s, e in blocks]
+    return [entry for future in futures for entry in future.result()]
+
+
+def _split_in_pool(path, ranges: list):
+    """Yields (start, end, bytes, seconds) per range, built in the pool, in order."""
+    ranges = iter(ranges)
+    pool = get_split_pool()
+
+    # Keep a bounded window of chunks in flight so large files aren't all held in memory
+    pending = deque()
+    def submit_next():
+        page_range = next(ranges, None)
+        if page_range:
+            pending.append((page_range, pool.submit(_split_range, os.fspath(path), *page_range)))
+
+    for _ in range(SPLIT_WORKERS * 2):
+        submit_next()
+    try:
+        while pending:
+            (start, end), future = pending.popleft()
+            data, seconds = future.result()
+            submit_next()
+            yield start, end, data, seconds
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+def split_pdf_to_chunks(source, page_texts: list = None, timings: list = None, plan: dict = None,
+                        budget: int = CHUNK_TOKEN_BUDGET, fingerprints: list = None, find_base=None):
+    """
+    Yields (start_page, end_page, pdf_bytes) for consecutive sub-PDFs whose
+    estimated input tokens fit the budget (see backend/chunk_planner.py).
+    Pages are 1-based and inclusive; chunks are byte-identical across runs
+    (no fresh trailer /ID), so they can be content-addressed.
+
+    A source given as a file path has its text extracted and its chunks built
+    by SPLIT_WORKERS worker processes, and chunks are yielded in page order as
+    they finish. Streams (or SPLIT_WORKERS=0) are split inline. If page_texts
+    is given, each page's extracted text is appended to it, and fingerprints
+    likewise receives page fingerprints; timings receives each chunk's pages,
+    size and split time, and plan the chosen chunk plan.
+
+    find_base, if given, is called with the page fingerprints and may return
+    an earlier version's (fingerprints, chunks). Its chunks covering unchanged
+    page runs are not rebuilt or yielded; they are listed, renumbered for this
+    document, in plan["reused"].
+    """
+    use_pool = SPLIT_WORKERS > 0 and isinstance(source, (str, os.PathLike))
+    doc = None if use_pool else open_pdf(source)
+    try:
+        t0 = time.perf_counter()
+        entries = _extract_in_pool(source) if use_pool else _page_entries(doc, 0, len(doc))
+        texts = [text for text, _ in entries]
+        page_fingerprints = [fingerprint for _, fingerprint in entries]
+        page_tokens = [estimate_page_tokens(text) for text in texts]
+        base = find_base(page_fingerprints) if find_base else None
+        if base:
+            ranges, reused = plan_with_reuse(page_tokens, page_fingerprints, *base, budget)
+        else:
+            ranges, reused = plan_chunks(page_tokens, budget), {}
+        if plan is not None:
+            plan.update(describe_plan(ranges, page_tokens, budget))
+            plan["reused"] = [dict(reused[start], start=start + 1, end=end) for start, end in ranges if start in reused]
+            plan["plan_seconds"] = round(time.perf_counter() - t0, 3)
+        if page_texts is not None:
+            page_texts.extend(texts)
+        if fingerprints is not None:
+            fingerprints.extend(page_fingerprints)
+
+        ranges = [(start, end) for start, end in ranges if start not in reused]
+        if use_pool:
+            chunks = _split_in_pool(source, ranges)
+        else:
+            chunks = ((start, end, *_build_chunk(doc, start, end)) for start, end in ranges)
+        for start, end, data, seconds in chunks:
+            _record(start, end, data, seconds, timings)
+            yield start + 1, end, data
+    finally:
+        if doc is not None:
+            doc.close()
+
+
+SPOOL_BLOCK_SIZE = 1024 * 1024  # 1 MiB
+
+
+def hash_file(fileobj, block_size=SPOOL_BLOCK_SIZE):
+    """
+    MD5 of a seekable file-like object read in fixed-size blocks, e.g. the
+    file Starlette has already spooled an upload to. Returns (md5 hex digest,
+    size in bytes) and leaves the file at its start.
+    """
+    hasher = hashlib.md5()
+    size = 0
+    fileobj.seek(0)
+    while True:
+        block = fileobj.read(block_size)
+        if not block:
+            break
+        hasher.update(block)
+        size += len(block)
+    fileobj.seek(0)
+    return hasher.hexdigest(), size
+
+
+def spool_to_disk(fileobj, block_size=SPOOL_BLOCK_SIZE):
+    """
+    Copies a file-like object to a named temp file in fixed-size blocks while
+    computing its MD5, so the upload is never held in memory as a whole.
+    Returns (path, md5 hex digest, size in bytes); the caller removes the file.
+    """
+    hasher = hashlib.md5()
+    size = 0
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+        while True:
+            block = fileobj.read(block_size)
+            if not block:
+                break
+            hasher.update(block)
+            tmp.write(block)
+            size += len(block)
+    return tmp.name, hasher.hexdigest(), size
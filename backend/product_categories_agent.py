@@ -1,12 +1,8 @@
 # product_categories_agent.py - Market Product Category Analysis
 
 import os
-import time
-from dotenv import load_dotenv
-from openai import OpenAI, RateLimitError
-
-load_dotenv()
-client = OpenAI()
+from backend.llm_scheduler import llm_call
+from backend.llm_client import stream_response_text
 
 # You'll need to create a new stored prompt for product categories
 PROMPT_ID = "pmpt_68c24f40e3048197b334d54591d657b00306289ef21fe211"  # Update this with new prompt ID
@@ -17,25 +13,30 @@ TOOLS = [
 ]
 
 def get_product_categories(industry: str, retries: int = 3) -> str:
-    for attempt in range(retries):
-        try:
-            print(f"Fetching product categories for {industry} [attempt {attempt+1}]")
-            response = client.responses.create(
-                prompt={
-                        "id": PROMPT_ID,
-                        "version": PROMPT_VERSION
-                        },
-                input=industry,
-                temperature=0.3
-            )
-            
-            final = next((o for o in response.output if getattr(o, "type", "") == "message"), None)
-            return "".join(part.text for part in final.content).strip() if final else "No product category data found"
-            
-        except Exception as e:
-            print(f"Error: {e}")
-            break
-    return "Failed to get product categories"
+    print(f"Fetching product categories for {industry}")
+    response = llm_call(lambda c: c.responses.create(
+        prompt={
+                "id": PROMPT_ID,
+                "version": PROMPT_VERSION
+                },
+        input=industry,
+        temperature=0.3
+    ), attempts=retries, agent="product_categories", label=f"product categories for {industry}")
+    
+    final = next((o for o in response.output if getattr(o, "type", "") == "message"), None)
+    return "".join(part.text for part in final.content).strip() if final else "No product category data found"
+    
+def stream_product_categories(industry: str):
+    """Streaming variant of get_product_categories: yields text deltas as the model produces them."""
+    yield from stream_response_text(
+        prompt={
+            "id": PROMPT_ID,
+            "version": PROMPT_VERSION
+        },
+        input=industry,
+        temperature=0.3
+    )
+
 def main():
     results = get_product_categories("Plastic MArket")
     print(results)
@@ -1,35 +1,104 @@
-import time
-from openai import OpenAI
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from openai import NotFoundError
+from backend.rate_limiter import document_limiter
+from backend.llm_scheduler import llm_call, BATCH
+from backend.page_index import page_ranges
+from backend.file_registry import file_registry
+from backend.cancellation import Cancelled, bind_context, raise_if_cancelled
 
 
-from dotenv import load_dotenv
-load_dotenv()
-client  = OpenAI()
-def query_chunks(query: str, file_id_chunks: list) -> str:
-    full_response = ""
-    for chunk in file_id_chunks:
-        file_id = chunk["file_id"]
-        start, end = chunk["start"], chunk["end"]
-        print(f" Querying pages {start}-{end} (File ID: {file_id})")
+QUERY_CONCURRENCY = int(os.getenv("QUERY_CONCURRENCY", "4"))
 
+
+def normalize_question(query: str) -> str:
+    """Cache key for a question: case, whitespace and trailing punctuation folded."""
+    return re.sub(r"\s+", " ", query.lower()).strip().rstrip("?.! ")
+
+
+def ask_file(file_id: str, prompt: str, retries: int = 3, label: str = "") -> str:
+    """
+    Asks the model a question about one uploaded file as batch work on the
+    shared scheduler, paced by the document rate limiter. Retryable errors are
+    retried by the scheduler; others propagate. A file the API no longer has
+    is dropped from the remote file registry.
+    """
+    print(f" Querying {label or file_id}")
+    try:
+        raw = llm_call(lambda c: c.responses.with_raw_response.create(
+            model="gpt-4o",
+            input=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "input_file", "file_id": file_id},
+                        {"type": "input_text", "text": prompt}
+                    ]
+                }
+            ]
+        ), priority=BATCH, attempts=retries, agent="document_chunk", label=label or file_id,
+            limiter=document_limiter)
+    except NotFoundError:
+        file_registry.forget(file_id)
+        raise RuntimeError("remote file no longer exists; re-upload the document")
+    return raw.parse().output_text.strip()
+
+
+def query_chunk(query: str, chunk: dict, answer_cache=None) -> str:
+    raise_if_cancelled("document query")
+    start, end = chunk["start"], chunk["end"]
+    query_key = normalize_question(query)
+    # Chunks carried over from an earlier version of a document share its file_id
+    answer = answer_cache.get(chunk["file_id"], query_key) if answer_cache else None
+    if answer is None:
         try:
-            response = client.responses.create(
-                model="gpt-4o",
-                input=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "input_file", "file_id": file_id},
-                            {"type": "input_text", "text": query}
-                        ]
-                    }
-                ]
-            )
-            full_response += f"\n\n### Pages {start}-{end}\n" + response.output_text.strip()
+            answer = ask_file(chunk["file_id"], query, label=f"pages {start}-{end}")
+        except Cancelled:
+            raise
         except Exception as e:
-            full_response += f"\n Error on pages {start}-{end}: {e}"
+            return f"\n Error on pages {start}-{end}: {e}"
+        if answer_cache:
+            answer_cache.put(chunk["file_id"], query_key, answer)
+    return f"\n\n### Pages {start}-{end}\n" + answer
+
+
+def query_chunks(query: str, file_id_chunks: list, answer_cache=None) -> str:
+    """
+    Asks the query of every chunk concurrently (paced by the shared adaptive
+    rate limiter) and joins the answers in page order. If answer_cache (with
+    get/put by file_id and normalized question) is given, chunks already
+    asked the same question are answered from it. Answers are cached as each
+    chunk finishes, so a query cancelled part-way only re-asks the rest.
+    """
+    if not file_id_chunks:
+        return ""
+    with ThreadPoolExecutor(max_workers=min(QUERY_CONCURRENCY, len(file_id_chunks))) as pool:
+        ask = bind_context(lambda chunk: query_chunk(query, chunk, answer_cache))
+        answers = list(pool.map(ask, file_id_chunks))
+    return "".join(answers).strip()
+
+
+PAGE_QUERY_INSTRUCTIONS = (
+    "Answer the question using only the document excerpts below. Cite page "
+    "numbers for figures you use. If the excerpts do not contain the answer, "
+    "say so.\n\nQuestion: {query}\n\n{excerpts}"
+)
 
-        time.sleep(1.5)
 
-    return full_response.strip()
+def query_pages(query: str, pages: list, retries: int = 3) -> str:
+    """
+    Answers a question from the extracted text of selected pages, given as
+    (page_number, text) pairs, in a single model call.
+    """
+    ranges = page_ranges([page for page, _ in pages])
+    label = ", ".join(f"{a}-{b}" if a != b else str(a) for a, b in ranges)
+    excerpts = "\n\n".join(f"[Page {page}]\n{text.strip()}" for page, text in sorted(pages))
+    prompt = PAGE_QUERY_INSTRUCTIONS.format(query=query, excerpts=excerpts)
+    print(f" Querying indexed pages {label}")
+    try:
+        raw = llm_call(lambda c: c.responses.with_raw_response.create(model="gpt-4o", input=prompt),
+                       attempts=retries, agent="document_pages", label=f"pages {label}", limiter=document_limiter)
+    except Exception as e:
+        return f"Error on pages {label}: {e}"
+    return f"### Pages {label}\n" + raw.parse().output_text.strip()
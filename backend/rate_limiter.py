@@ -0,0 +1,120 @@
+# rate_limiter.py - Adaptive token bucket shared by threads making OpenAI calls
+
+import os
+import re
+import time
+import threading
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_reset(value: str) -> float:
+    """Parses OpenAI reset durations like "20ms", "1s" or "6m0s" into seconds."""
+    if not value:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        return sum(float(n) * _UNIT_SECONDS[u] for n, u in _DURATION_PART.findall(value))
+
+
+def retry_after_seconds(headers) -> float:
+    """Server-requested wait from retry-after-ms / retry-after headers, else 0."""
+    if headers is None:
+        return 0.0
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if headers.get("retry-after"):
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            pass
+    return 0.0
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose refill rate adapts to the API: it halves on a rate-limit
+    error and pauses for the server's Retry-After, then creeps back up after
+    each success. Rate-limit response headers cap the rate at the account's
+    request limit and pause the bucket when the remaining quota hits zero.
+    """
+
+    def __init__(self, rate: float, burst: int, min_rate: float = 0.2, max_rate: float = None,
+                 increase: float = 0.1):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate * 4
+        self.increase = increase
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+        self.throttled = 0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+                self._cond.wait(timeout=wait)
+
+    def on_success(self, headers=None):
+        with self._cond:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+            self._apply_headers(headers)
+
+    def on_rate_limited(self, headers=None):
+        with self._cond:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0
+            wait = retry_after_seconds(headers) or 1 / self.rate
+            self._paused_until = max(self._paused_until, time.monotonic() + wait)
+            self._apply_headers(headers)
+            self._cond.notify_all()
+
+    def _apply_headers(self, headers):
+        if headers is None:
+            return
+        limit = headers.get("x-ratelimit-limit-requests")
+        if limit:
+            try:
+                # Limits are per minute; never plan to exceed them
+                self.max_rate = max(self.min_rate, float(limit) / 60)
+                self.rate = min(self.rate, self.max_rate)
+            except ValueError:
+                pass
+        if headers.get("x-ratelimit-remaining-requests") == "0":
+            reset = parse_reset(headers.get("x-ratelimit-reset-requests"))
+            self._paused_until = max(self._paused_until, time.monotonic() + reset)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "rate_per_second": round(self.rate, 3),
+                "max_rate_per_second": round(self.max_rate, 3),
+                "paused_for_seconds": round(max(0.0, self._paused_until - time.monotonic()), 3),
+                "throttled": self.throttled,
+            }
+
+
+# Shared by the document chunk fan-outs (Q&A and comparison)
+document_limiter = AdaptiveRateLimiter(
+    rate=float(os.getenv("DOCUMENT_QUERY_RATE", "2")),
+    burst=int(os.getenv("DOCUMENT_QUERY_BURST", "4")),
+)
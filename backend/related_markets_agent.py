@@ -1,12 +1,8 @@
 # related_markets_agent.py - Related Markets Analysis
 
 import os
-import time
-from dotenv import load_dotenv
-from openai import OpenAI, RateLimitError
-
-load_dotenv()
-client = OpenAI()
+from backend.llm_scheduler import llm_call
+from backend.llm_client import stream_response_text
 
 PROMPT_ID = "pmpt_68fb0ea6c850819585c25e168d89e2bf0b2e0207465f0fd4"  # ← Update this after creating prompt
 PROMPT_VERSION = "3"
@@ -16,27 +12,28 @@ TOOLS = [
 ]
 
 def get_related_markets(industry: str, retries: int = 3) -> str:
-    for attempt in range(retries):
-        try:
-            print(f"Fetching related markets for {industry} [attempt {attempt+1}]")
-            response = client.responses.create(
-                prompt={
-                    "id": PROMPT_ID,
-                    "version": PROMPT_VERSION
-                },
-                input=industry,
-                temperature=0.3
-            )
-            final = next((o for o in response.output if getattr(o, "type", "") == "message"), None)
-            return "".join(part.text for part in final.content).strip() if final else "(no output)"
-        except RateLimitError:
-            delay = 3 + attempt * 2
-            print(f"⚠️ Rate limit. Retrying in {delay}s...")
-            time.sleep(delay)
-        except Exception as e:
-            print(f"Error fetching related markets: {e}")
-            break
-    return "⚠️ Failed to retrieve related markets."
+    print(f"Fetching related markets for {industry}")
+    response = llm_call(lambda c: c.responses.create(
+        prompt={
+            "id": PROMPT_ID,
+            "version": PROMPT_VERSION
+        },
+        input=industry,
+        temperature=0.3
+    ), attempts=retries, agent="related_markets", label=f"related markets for {industry}")
+    final = next((o for o in response.output if getattr(o, "type", "") == "message"), None)
+    return "".join(part.text for part in final.content).strip() if final else "(no output)"
+
+def stream_related_markets(industry: str):
+    """Streaming variant of get_related_markets: yields text deltas as the model produces them."""
+    yield from stream_response_text(
+        prompt={
+            "id": PROMPT_ID,
+            "version": PROMPT_VERSION
+        },
+        input=industry,
+        temperature=0.3
+    )
 
 def main():
     '''
@@ -0,0 +1,121 @@
+# search_index.py - SQLite FTS5 index over cached analyses, M&A results and PDF filenames
+
+import re
+from sqlalchemy import text, column, Integer, DateTime
+from sqlalchemy.exc import OperationalError
+
+FTS_TOKENIZER = "unicode61 remove_diacritics 2"
+SNIPPET_TOKENS = 16
+
+# Indexed tables: the name column (weighted higher in ranking) first, then any
+# long text; display fields are returned with each hit.
+FTS_SOURCES = {
+    "market_analysis": {
+        "columns": ("market", "data"),
+        "weights": (10.0, 1.0),
+        "fields": ("market", "analysis_type", "created_at"),
+    },
+    "ma_history": {
+        "columns": ("market", "result"),
+        "weights": (10.0, 1.0),
+        "fields": ("market", "timeframe", "timestamp"),
+    },
+    "pdf_history": {
+        "columns": ("filename",),
+        "weights": (1.0,),
+        "fields": ("pdf_id", "filename", "processed_at"),
+    },
+}
+
+
+def fts_table(table: str) -> str:
+    return f"{table}_fts"
+
+
+def fts_statements(table: str, columns: tuple) -> list:
+    """
+    DDL for an external-content FTS5 table over table's columns (it stores
+    only the index, not a copy of the text) and the triggers that keep it in
+    step with inserts, updates and deletes.
+    """
+    fts = fts_table(table)
+    cols = ", ".join(columns)
+    new = ", ".join(f"new.{c}" for c in columns)
+    old = ", ".join(f"old.{c}" for c in columns)
+    delete = f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old});"
+    insert = f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{table}', content_rowid='id', "
+        f"tokenize='{FTS_TOKENIZER}', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN {delete} {insert} END",
+    ]
+
+
+def setup_fts(engine) -> bool:
+    """
+    Creates the FTS tables and triggers on SQLite (building the index from
+    existing rows the first time). Returns False where FTS5 is unavailable,
+    e.g. on a server database, so callers fall back to LIKE filters.
+    """
+    if engine.dialect.name != "sqlite":
+        return False
+    try:
+        with engine.begin() as conn:
+            existing = {name for (name,) in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+            for table, source in FTS_SOURCES.items():
+                for statement in fts_statements(table, source["columns"]):
+                    conn.execute(text(statement))
+                if fts_table(table) not in existing:
+                    fts = fts_table(table)
+                    conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+                    print(f"🔎 Built full-text index {fts}")
+    except OperationalError as e:
+        print(f"⚠️ Full-text search disabled: {e}")
+        return False
+    return True
+
+
+def match_query(query: str, prefix_all: bool = False, column: str = None):
+    """
+    FTS5 MATCH expression for free text: "quoted phrases" stay phrases, other
+    words are ANDed. The last word (every word with prefix_all) matches as a
+    prefix, for search-as-you-type. Returns None if there is nothing to match.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]+)"|(\w+)', query):
+        if phrase:
+            words = re.findall(r"\w+", phrase)
+            if words:
+                terms.append('"' + " ".join(words) + '"')
+        else:
+            terms.append(f'"{word}"')
+    if not terms:
+        return None
+    for i, term in enumerate(terms):
+        if (prefix_all or i == len(terms) - 1) and " " not in term:
+            terms[i] = term + "*"
+    expression = " ".join(terms)
+    return f"{column} : ({expression})" if column else expression
+
+
+def matching_ids(table: str, match: str):
+    """Subquery of table ids whose FTS row matches (for IN filters)."""
+    fts = fts_table(table)
+    return text(f"SELECT rowid FROM {fts} WHERE {fts} MATCH :match").bindparams(match=match)\
+        .columns(column("rowid", Integer))
+
+
+def search_query(table: str, match: str, limit: int):
+    """Ranked hits in one source: display fields, an excerpt around the match and the bm25 rank."""
+    source = FTS_SOURCES[table]
+    fts = fts_table(table)
+    fields = ", ".join(f"t.{f}" for f in source["fields"])
+    weights = ", ".join(str(w) for w in source["weights"])
+    return text(
+        f"SELECT t.id AS id, {fields}, "
+        f"snippet({fts}, -1, '**', '**', '…', {SNIPPET_TOKENS}) AS snippet, bm25({fts}, {weights}) AS rank "
+        f"FROM {fts} JOIN {table} t ON t.id = {fts}.rowid "
+        f"WHERE {fts} MATCH :match ORDER BY rank LIMIT :limit"
+    ).bindparams(match=match, limit=limit).columns(**{source["fields"][-1]: DateTime})
@@ -0,0 +1,52 @@
+# singleflight.py - Coalesce concurrent identical async work onto a single in-flight task
+
+import asyncio
+
+
+class SingleFlight:
+    """
+    In-flight request table keyed by cache key. The first caller for a key
+    (the leader) starts the work; callers arriving while it is still running
+    (followers) await the same task instead of repeating the LLM call or upload.
+    The work is cancelled only once every caller waiting for it has gone.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self._waiters = {}  # task -> number of callers awaiting it
+        self.stats = {"leaders": 0, "followers": 0, "abandoned": 0}
+
+    async def do(self, key, func):
+        """Result of func() for key; func returns a coroutine, or a task that is used as is."""
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats["leaders"] += 1
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            self._waiters[task] = 0
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.stats["followers"] += 1
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            # Shield so one waiter giving up does not cancel the work for the others
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task in self._waiters and self._waiters[task] == 1 and not task.done():
+                self.stats["abandoned"] += 1
+                task.cancel()
+                # Callers arriving from now on start fresh work
+                self._forget(key, task)
+            raise
+        finally:
+            if task in self._waiters:
+                self._waiters[task] -= 1
+
+    def _forget(self, key, task):
+        if task.done():
+            self._waiters.pop(task, None)
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def in_flight(self) -> int:
+        return len(self._inflight)
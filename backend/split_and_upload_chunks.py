@@ -1,30 +1,69 @@
-import fitz  # PyMuPDF
-import tempfile
-from openai import OpenAI
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from backend.pdf_chunks_util import split_pdf_to_chunks, SPLIT_WORKERS
+from backend.file_registry import file_registry
+from backend.cancellation import bind_context, raise_if_cancelled
 
 #client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 #client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
 
-client = OpenAI()
-CHUNK_SIZE = 50
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
 
-def split_and_upload_pdf_chunks(file_stream) -> list:
-    doc = fitz.open(stream=file_stream.read(), filetype="pdf")
-    total_pages = len(doc)
-    file_id_chunks = []
 
-    for start in range(0, total_pages, CHUNK_SIZE):
-        end = min(start + CHUNK_SIZE, total_pages)
-        chunk_doc = fitz.open()
-        chunk_doc.insert_pdf(doc, from_page=start, to_page=end - 1)
+def upload_chunk(data: bytes, start: int, end: int) -> tuple:
+    """
+    Uploads one in-memory chunk PDF unless the registry already holds a live
+    remote copy of the same bytes; returns (chunk dict, upload seconds, uploaded).
+    """
+    t0 = time.perf_counter()
+    file_id, sha256, uploaded = file_registry.get_or_upload(data, f"pages_{start}-{end}.pdf")
+    chunk = {"file_id": file_id, "start": start, "end": end, "sha256": sha256}
+    return chunk, time.perf_counter() - t0, uploaded
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            chunk_doc.save(tmp.name)
-            uploaded = client.files.create(file=open(tmp.name, "rb"), purpose="user_data")
-            file_id_chunks.append({"file_id": uploaded.id, "start": start + 1, "end": end})
 
-        chunk_doc.close()
+def split_and_upload_pdf_chunks(source, stats: dict = None, page_texts: list = None, fingerprints: list = None,
+                                find_base=None) -> list:
+    """
+    Splits a PDF (a file path, split in worker processes, or a readable
+    stream) into token-budgeted sub-PDFs held in memory and uploads them
+    with up to UPLOAD_CONCURRENCY uploads in flight; chunks already uploaded
+    (by any path) are reused. Chunks are returned in page order. If a stats
+    dict is passed, the chunk plan and per-chunk split/upload timings are
+    recorded in it; if a page_texts list is passed, each page's text is
+    appended to it for the page index, and fingerprints receives each page's
+    fingerprint. find_base (see split_pdf_to_chunks) lets a revised document
+    carry over an earlier version's chunks for unchanged page runs.
+    """
+    t_start = time.perf_counter()
+    pending = []
+    timings = []
+    plan = {}
 
-    doc.close()
+    upload = bind_context(upload_chunk)
+    with ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as pool:
+        for start, end, data in split_pdf_to_chunks(source, page_texts, timings, plan,
+                                                    fingerprints=fingerprints, find_base=find_base):
+            raise_if_cancelled("upload")
+            # Uploads of earlier chunks overlap with splitting the next ones
+            pending.append(pool.submit(upload, data, start, end))
+        split_done = time.perf_counter()
+
+        file_id_chunks = []
+        for timing, future in zip(timings, pending):
+            chunk, upload_seconds, uploaded = future.result()
+            timing["upload_seconds"] = round(upload_seconds, 3)
+            timing["reused"] = not uploaded
+            file_id_chunks.append(chunk)
+    file_id_chunks = sorted(file_id_chunks + plan["reused"], key=lambda chunk: chunk["start"])
+
+    if stats is not None:
+        stats["pages"] = plan["pages"]
+        stats["chunks"] = timings
+        stats["plan"] = plan
+        stats["uploaded"] = sum(1 for t in timings if not t["reused"])
+        stats["carried_over"] = len(plan["reused"])
+        stats["split_workers"] = SPLIT_WORKERS if isinstance(source, (str, os.PathLike)) else 0
+        stats["split_wall_seconds"] = round(split_done - t_start, 3)
+        stats["wall_seconds"] = round(time.perf_counter() - t_start, 3)
     return file_id_chunks
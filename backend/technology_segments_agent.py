@@ -1,12 +1,8 @@
 # technology_segments_agent.py - Market Technology Segmentation Analysis
 
 import os
-import time
-from dotenv import load_dotenv
-from openai import OpenAI, RateLimitError
-
-load_dotenv()
-client = OpenAI()
+from backend.llm_scheduler import llm_call
+from backend.llm_client import stream_response_text
 
 # You'll need to create a new stored prompt for technology segmentation
 PROMPT_ID = "pmpt_68bfb28da9b88197b73220fb7ea78eb203fe75cfa56065f9"  # Update this with new prompt ID
@@ -23,27 +19,28 @@ def get_technology_segments(industry: str, retries: int = 3) -> str:
     Examples: In EV market - Battery Electric, Hydrogen Fuel Cell, Hybrid Technologies
     """
     
-    for attempt in range(retries):
-        try:
-            print(f"Fetching technology segments for {industry} [attempt {attempt+1}]")
-            response = client.responses.create(
-                prompt={
-                        "id": PROMPT_ID,
-                        "version": PROMPT_VERSION
-                        },
-                input=industry,
-                temperature=0.3
-            )
-            final = next((o for o in response.output if getattr(o, "type", "") == "message"), None)
-            return "".join(part.text for part in final.content).strip() if final else "(no output)"
-        except RateLimitError:
-            delay = 3 + attempt * 2
-            print(f"⚠️ Rate limit. Retrying in {delay}s...")
-            time.sleep(delay)
-        except Exception as e:
-            print(f"Error fetching technology segments: {e}")
-            break
-    return "⚠️ Failed to retrieve market technology segments."
+    print(f"Fetching technology segments for {industry}")
+    response = llm_call(lambda c: c.responses.create(
+        prompt={
+                "id": PROMPT_ID,
+                "version": PROMPT_VERSION
+                },
+        input=industry,
+        temperature=0.3
+    ), attempts=retries, agent="technology_segments", label=f"technology segments for {industry}")
+    final = next((o for o in response.output if getattr(o, "type", "") == "message"), None)
+    return "".join(part.text for part in final.content).strip() if final else "(no output)"
+
+def stream_technology_segments(industry: str):
+    """Streaming variant of get_technology_segments: yields text deltas as the model produces them."""
+    yield from stream_response_text(
+        prompt={
+            "id": PROMPT_ID,
+            "version": PROMPT_VERSION
+        },
+        input=industry,
+        temperature=0.3
+    )
 
 def main():
     '''
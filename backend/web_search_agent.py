@@ -1,12 +1,10 @@
 # web_search_agent.py
 
-from openai import OpenAI
 import os
-from dotenv import load_dotenv
+from backend.llm_scheduler import llm_call
+from backend.llm_client import stream_response_text
 
-load_dotenv()
 #client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-client = OpenAI()
 
 PROMPT_ID = "pmpt_688912c5d8cc8197b40a0409ce168ac2056afb650c14b3be"
 PROMPT_VERSION = "1"
@@ -18,7 +16,7 @@ def search_web_insights(prompt: str) -> str:
     """
     
     try:
-        response = client.responses.create(
+        response = llm_call(lambda c: c.responses.create(
             prompt={
                 "id": PROMPT_ID,
                 "version": PROMPT_VERSION
@@ -26,11 +24,22 @@ def search_web_insights(prompt: str) -> str:
             input=prompt,      # <-- just a string, not {"submarket": submarket}
             temperature=0.3
 
-        )
+        ), agent="web_insights", label="web insights")
         return response.output_text.strip()
     except Exception as e:
         return f" Web search failed: {e}"
 
+def stream_web_insights(prompt: str):
+    """Streaming variant of search_web_insights: yields text deltas as the model produces them."""
+    yield from stream_response_text(
+        prompt={
+            "id": PROMPT_ID,
+            "version": PROMPT_VERSION
+        },
+        input=prompt,
+        temperature=0.3
+    )
+
 def main():
     st.title("Web Search Agent")
     market = st.text_input("Market (e.g. Electric Vehicles)", value="Electric Vehicles")
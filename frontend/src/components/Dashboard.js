@@ -1981,6 +1981,8 @@ const linkifyBareUrls = (htmlString) => {
     try {
       const response = await apiCall('/documents/query', 'POST', {
         query: pdfQuery,
+        // pdf_id lets the backend look up chunks itself and serve cached answers
+        pdf_id: typeof currentPdfId === 'string' ? currentPdfId : undefined,
         file_chunks: pdfChunks
       });
 
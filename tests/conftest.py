@@ -0,0 +1,8 @@
+# conftest.py - Points the API at a throwaway SQLite database before backend modules are imported
+
+import os
+import tempfile
+
+_tmpdir = tempfile.mkdtemp(prefix="market-research-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmpdir, 'test.db')}")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
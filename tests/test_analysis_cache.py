@@ -0,0 +1,37 @@
+# test_analysis_cache.py - Cache stats count each lookup once, against the tier that served it
+
+import asyncio
+
+import backend.fastapi_wrapper as api
+from backend.analysis_cache import AnalysisCache
+
+
+def test_stats_count_each_tier(monkeypatch):
+    cache = AnalysisCache()
+    monkeypatch.setattr(api, "analysis_cache", cache)
+    calls = []
+
+    def agent(market):
+        calls.append(market)
+        return f"analysis of {market}"
+
+    def lookup():
+        return asyncio.run(api.get_or_create_analysis("Quantum sensing stats", "global", agent))
+
+    assert lookup()[1] is False      # computed
+    assert lookup()[1] is True       # memory tier
+    cache.invalidate("quantum sensing stat")
+    assert lookup()[1] is True       # DB tier
+
+    stats = cache.stats()
+    assert len(calls) == 1
+    assert (stats["lookups"], stats["hits"], stats["db_hits"], stats["misses"]) == (3, 1, 1, 1)
+    assert stats["hit_rate"] == stats["db_hit_rate"] == round(1 / 3, 4)
+
+
+def test_peek_does_not_count():
+    cache = AnalysisCache()
+    cache.set("ev", "global", "text")
+    assert cache.peek("ev", "global") == "text"
+    assert cache.peek("ev", "regional") is None
+    assert (cache.hits, cache.misses) == (0, 0)
@@ -0,0 +1,42 @@
+# test_delete_document.py - Deleting a document removes its rows and its unshared remote files
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import backend.fastapi_wrapper as api
+
+
+def test_delete_pdf_history(monkeypatch):
+    collected = []
+
+    def collect_garbage(referenced, candidates):
+        collected.append(list(candidates))
+        return [f for f in candidates if f not in referenced]
+
+    monkeypatch.setattr(api.file_registry, "collect_garbage", collect_garbage)
+    with api.SessionLocal() as db:
+        db.add(api.PDFHistory(pdf_id="doc-a", filename="a.pdf", chunks=[{"file_id": "f1"}, {"file_id": "f2"}],
+                              chunks_count=2, page_fingerprints=[]))
+        db.add(api.PDFHistory(pdf_id="doc-b", filename="b.pdf", chunks=[{"file_id": "f2"}],
+                              chunks_count=1, page_fingerprints=[]))
+        db.add(api.PDFPage(pdf_id="doc-a", page=1, text="page one", fingerprint="p1"))
+        db.add(api.DocumentQA(pdf_id="doc-a", query_key="q", query="q?", answer="a", mode="index"))
+        db.add_all([api.ChunkAnswer(file_id=f, query_key="q", answer="a") for f in ("f1", "f2")])
+        db.commit()
+
+    result = asyncio.run(api.delete_pdf_history("doc-a"))
+
+    assert result["remote_files_deleted"] == 1
+    assert collected == [["f1", "f2"]]
+    with api.SessionLocal() as db:
+        assert db.query(api.PDFHistory).filter_by(pdf_id="doc-a").count() == 0
+        assert db.query(api.PDFPage).filter_by(pdf_id="doc-a").count() == 0
+        assert db.query(api.DocumentQA).filter_by(pdf_id="doc-a").count() == 0
+        # f2 is still referenced by doc-b
+        assert [r.file_id for r in db.query(api.ChunkAnswer).filter(api.ChunkAnswer.file_id.in_(["f1", "f2"]))] == ["f2"]
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(api.delete_pdf_history("doc-a"))
+    assert e.value.status_code == 404
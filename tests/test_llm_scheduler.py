@@ -0,0 +1,167 @@
+# test_llm_scheduler.py - Priority admission, slot accounting, deadlines and Retry-After in the LLM scheduler
+
+import time
+import threading
+import contextvars
+
+import httpx
+import pytest
+from openai import RateLimitError
+
+from backend.cancellation import Cancelled, CancelToken, current_cancel
+from backend.llm_scheduler import (LLMScheduler, DeadlineExceeded, INTERACTIVE, BATCH, backoff_delay,
+                                   LLM_BACKOFF_BASE, LLM_HEDGE_MIN_SAMPLES)
+
+
+def under_token(token, fn, *args, **kwargs):
+    """fn(*args, **kwargs) as a run_agent worker with this cancel token would run it."""
+    def run():
+        current_cancel.set(token)
+        return fn(*args, **kwargs)
+    return contextvars.copy_context().run(run)
+
+
+def wait_until(condition, timeout: float = 5):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def running(scheduler) -> int:
+    return scheduler.stats()["running"]
+
+
+def blocking(release: threading.Event, result="done"):
+    def func(client):
+        release.wait(5)
+        return result
+    return func
+
+
+def test_interactive_calls_overtake_queued_batch_calls():
+    scheduler = LLMScheduler(max_concurrency=1)
+    release = threading.Event()
+    order = []
+
+    def record(label):
+        def func(client):
+            order.append(label)
+            return label
+        return func
+
+    holder = threading.Thread(target=scheduler.call, args=(blocking(release),), kwargs={"priority": BATCH})
+    holder.start()
+    wait_until(lambda: running(scheduler) == 1)
+    batch = threading.Thread(target=scheduler.call, args=(record("batch"),), kwargs={"priority": BATCH})
+    batch.start()
+    wait_until(lambda: scheduler.stats()["classes"][BATCH]["queued"] == 1)
+    interactive = threading.Thread(target=scheduler.call, args=(record("interactive"),),
+                                   kwargs={"priority": INTERACTIVE})
+    interactive.start()
+    wait_until(lambda: scheduler.stats()["classes"][INTERACTIVE]["queued"] == 1)
+
+    release.set()
+    for t in (holder, batch, interactive):
+        t.join(5)
+    assert order == ["interactive", "batch"]
+    assert running(scheduler) == 0
+
+
+def test_cancelled_call_keeps_slot_until_request_returns():
+    scheduler = LLMScheduler(max_concurrency=1)
+    release = threading.Event()
+    token = CancelToken()
+    errors = []
+
+    def worker():
+        try:
+            under_token(token, scheduler.call, blocking(release))
+        except Cancelled as e:
+            errors.append(e)
+
+    t = threading.Thread(target=worker)
+    t.start()
+    wait_until(lambda: running(scheduler) == 1)
+    token.cancel()
+    t.join(5)
+    assert len(errors) == 1
+    # The request already sent is still in flight and holds its slot
+    assert running(scheduler) == 1
+    release.set()
+    wait_until(lambda: running(scheduler) == 0)
+
+
+def test_losing_hedge_releases_its_slot():
+    scheduler = LLMScheduler(max_concurrency=2)
+    for _ in range(LLM_HEDGE_MIN_SAMPLES):
+        scheduler.histogram("hedge-test").record(0.01)
+    release = threading.Event()
+    calls = []
+
+    def func(client):
+        calls.append(client)
+        if len(calls) == 1:
+            release.wait(5)
+            return "primary"
+        return "backup"
+
+    assert scheduler.call(func, agent="hedge-test", deadline=5) == "backup"
+    assert scheduler.hedging["hedged"] == scheduler.hedging["hedge_won"] == 1
+    # The backup's slot is freed once it returns; the slow primary keeps its own
+    wait_until(lambda: running(scheduler) == 1)
+    time.sleep(0.1)
+    assert running(scheduler) == 1
+    release.set()
+    wait_until(lambda: running(scheduler) == 0)
+
+
+def test_deadline_exceeded():
+    scheduler = LLMScheduler(max_concurrency=1)
+    release = threading.Event()
+    t0 = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        under_token(CancelToken(), scheduler.call, blocking(release), deadline=0.3)
+    assert 0.3 <= time.monotonic() - t0 < 1.5
+    assert scheduler.hedging["deadline_exceeded"] == 1
+    release.set()
+    wait_until(lambda: running(scheduler) == 0)
+
+
+def rate_limited(headers: dict) -> RateLimitError:
+    request = httpx.Request("POST", "https://api.openai.com/v1/responses")
+    return RateLimitError("rate limited", response=httpx.Response(429, headers=headers, request=request), body=None)
+
+
+def test_backoff_respects_retry_after():
+    assert backoff_delay(0, {"retry-after": "3"}) >= 3
+    assert backoff_delay(0, {"retry-after-ms": "1500"}) >= 1.5
+    # Without one it is plain jitter, capped by the attempt's exponential bound
+    assert 0 <= backoff_delay(0, None) <= LLM_BACKOFF_BASE
+
+
+def test_retry_waits_for_retry_after():
+    class RecordingToken(CancelToken):
+        def __init__(self):
+            super().__init__()
+            self.waits = []
+
+        def wait(self, timeout):
+            self.waits.append(timeout)
+            return False
+
+    scheduler = LLMScheduler(max_concurrency=1)
+    attempts = []
+
+    def func(client):
+        attempts.append(client)
+        if len(attempts) == 1:
+            raise rate_limited({"retry-after": "2"})
+        return "ok"
+
+    token = RecordingToken()
+    assert under_token(token, scheduler.call, func, deadline=10) == "ok"
+    assert len(attempts) == 2
+    assert len(token.waits) == 1 and token.waits[0] >= 2
+    wait_until(lambda: running(scheduler) == 0)
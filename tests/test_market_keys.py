@@ -0,0 +1,78 @@
+# test_market_keys.py - Canonical market keys and typo-only fuzzy matching
+
+import asyncio
+
+import pytest
+
+from backend.market_keys import MarketIndex, canonical_market, tokens_agree
+
+
+def index_of(*names) -> MarketIndex:
+    index = MarketIndex(threshold=0.8)
+    for name in names:
+        index.add(canonical_market(name))
+    return index
+
+
+@pytest.mark.parametrize("name, key", [
+    ("Electric Vehicles", "electric vehicle"),
+    ("  electric vehicles ", "electric vehicle"),
+    ("EV market", "electric vehicle"),
+    ("The Global Batteries Industry", "battery"),
+    ("Café & Restaurants", "cafe and restaurant"),
+    ("3D printing", "additive manufacturing"),
+])
+def test_canonical_market_folds_spelling_variants(name, key):
+    assert canonical_market(name) == key
+
+
+@pytest.mark.parametrize("known, requested", [
+    ("Level 2 autonomous driving software", "Level 4 autonomous driving software"),
+    ("North American electric vehicle charging infrastructure",
+     "South American electric vehicle charging infrastructure"),
+    ("Class 8 heavy duty truck electrification", "Class 6 heavy duty truck electrification"),
+    ("Type 1 diabetes continuous glucose monitoring devices",
+     "Type 2 diabetes continuous glucose monitoring devices"),
+    ("number 1 widget", "Market number 11 widgets"),
+])
+def test_resolve_keeps_distinct_markets_apart(known, requested):
+    index = index_of(known)
+    # Trigram similarity alone would merge these
+    assert index.best_match(canonical_market(requested))[1] >= 0.8
+    assert index.resolve(requested) == (canonical_market(requested), False)
+
+
+@pytest.mark.parametrize("known, requested", [
+    ("Electric vehicle charging", "electric vehicle chargng market"),
+    ("Level 2 autonomous driving software", "Level 2 autonomus driving software"),
+])
+def test_resolve_matches_typos(known, requested):
+    assert index_of(known).resolve(requested) == (canonical_market(known), True)
+
+
+def test_resolve_prefers_exact_key():
+    index = index_of("Level 2 autonomous driving software", "Level 4 autonomous driving software")
+    assert index.resolve("level 4 autonomous driving software") == ("level 4 autonomous driving software", False)
+
+
+def test_tokens_agree():
+    assert tokens_agree("solar panel", "solar panl")
+    assert not tokens_agree("solar panel", "polar panel")
+    assert not tokens_agree("north american ev", "south american ev")
+    assert not tokens_agree("number 1 widget", "number 11 widget")
+    assert not tokens_agree("electric vehicle", "electric vehicle battery")
+
+
+def test_new_analysis_is_stored_under_its_own_key(monkeypatch):
+    import backend.fastapi_wrapper as api
+
+    # A near-duplicate is known but has nothing fresh to read
+    monkeypatch.setattr(api, "market_index", index_of("Level 2 autonomous driving software"))
+    data, cached, key = asyncio.run(api.get_or_create_analysis(
+        "Level 2 autonomus driving software", "global", lambda market: f"analysis of {market}"))
+
+    assert (data, cached) == ("analysis of Level 2 autonomus driving software", False)
+    assert key == canonical_market("Level 2 autonomus driving software")
+    with api.SessionLocal() as db:
+        row = db.query(api.MarketAnalysis).filter_by(data=data).one()
+    assert row.market_key == key
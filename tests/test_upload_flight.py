@@ -0,0 +1,74 @@
+# test_upload_flight.py - Coalesced uploads keep the shared spooled file until the shared work is done
+
+import io
+import os
+import asyncio
+import threading
+
+from starlette.datastructures import UploadFile
+
+import backend.fastapi_wrapper as api
+
+
+def make_upload(data: bytes) -> UploadFile:
+    return UploadFile(file=io.BytesIO(data), filename="report.pdf")
+
+
+async def wait_until(condition, timeout: float = 10):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("timed out")
+
+
+def upload(data: bytes):
+    return asyncio.ensure_future(api.upload_document(file=make_upload(data)))
+
+
+def test_follower_survives_leader_cancellation(monkeypatch):
+    release = threading.Event()
+    spooled = []
+    read = []
+
+    spool_to_disk = api.spool_to_disk
+
+    def spool(fileobj):
+        path, md5, size = spool_to_disk(fileobj)
+        spooled.append(path)
+        return path, md5, size
+
+    def split(path, timings, page_texts, fingerprints, find_base):
+        release.wait(10)
+        with open(path, "rb") as f:
+            read.append(f.read())
+        timings.update(carried_over=0, plan={"fill_ratio": 1.0}, uploaded=1, wall_seconds=0.0)
+        return [{"file_id": "file-1", "start_page": 1, "end_page": 1}]
+
+    monkeypatch.setattr(api, "spool_to_disk", spool)
+    monkeypatch.setattr(api, "split_and_upload_pdf_chunks", split)
+    data = b"%PDF-1.4 leader cancellation " + os.urandom(16)
+
+    async def scenario():
+        leader = upload(data)
+        await wait_until(lambda: api.upload_flight.in_flight() == 1 or leader.done())
+        followers = api.upload_flight.stats["followers"]
+        follower = upload(data)
+        await wait_until(lambda: api.upload_flight.stats["followers"] > followers or follower.done())
+
+        # The leader's client goes away while the split is still running
+        leader.cancel()
+        try:
+            await leader
+        except asyncio.CancelledError:
+            pass
+        release.set()
+        return await follower
+
+    result = asyncio.run(scenario())
+
+    assert result["success"]
+    assert result["data"]["chunks"] == [{"file_id": "file-1", "start_page": 1, "end_page": 1}]
+    assert read == [data]
+    assert len(spooled) == 2
+    assert not any(os.path.exists(path) for path in spooled)